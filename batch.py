@@ -0,0 +1,117 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import Interpreter
+from machine import Machine
+from replay import InputReplay
+
+# ROM to run, input log to replay (or None), number of frames and whether to
+# interpret instead of translating
+Job = namedtuple('Job', 'rom replay frames interpret')
+
+
+def run_job(job):
+    """
+    Runs a ROM headless for a number of frames
+
+    Returns a dict of the results, the sha1 of the memory at the last frame
+    or the error the run ended with.
+    """
+    result = {'rom': job.rom, 'replay': job.replay, 'frames': 0, 'sha1': None,
+              'elapsed': 0.0, 'frames_per_second': 0.0, 'error': None}
+    start = time.perf_counter()
+    machine = None
+    try:
+        with open(job.rom, 'rb') as f:
+            machine = Machine(f.read())
+        if job.interpret:
+            machine.engine = Interpreter()
+        inputs = InputReplay(job.replay, machine) if job.replay else None
+
+        def frame():
+            frames = machine.display.frames
+            if inputs is not None:
+                inputs.latch(frames)
+            if frames >= job.frames:
+                result['sha1'] = hashlib.sha1(machine.state.memory).hexdigest()
+                machine.stop()
+
+        machine.display.frame_hooks.append(frame)
+        machine.run()
+    except (Exception, SystemExit):
+        # HLT exits
+        result['error'] = traceback.format_exc()
+        if machine is not None:
+            result['error'] += "at pc %04x, cycle %d" % (machine.state.pc, machine.state.cycles)
+
+    if machine is not None:
+        result['frames'] = machine.display.frames
+    result['elapsed'] = time.perf_counter() - start
+    result['frames_per_second'] = result['frames'] / result['elapsed']
+    return result
+
+
+def run_jobs(jobs, workers=None):
+    """
+    Runs jobs on a pool of processes
+
+    Arguments:
+        jobs (list): Job tuples
+        workers (int): number of processes, the number of cores by default
+
+    Returns the results of run_job, in the order of the jobs
+    """
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        return list(pool.map(run_job, jobs))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run many headless Space Invaders instances in parallel"
+    )
+    parser.add_argument('jobs', nargs='+', metavar='ROM[,REPLAY]',
+                        help="ROM to run, optionally with an input log to replay")
+    parser.add_argument('-n', '--instances', type=int, default=1,
+                        help="Number of instances of every job")
+    parser.add_argument('-f', '--frames', type=int, default=600,
+                        help="Number of frames to run every instance for")
+    parser.add_argument('-i', '--interpret', action='store_true', default=False,
+                        help="Interpret every instruction instead of translating blocks of code")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Number of processes, the number of cores by default")
+    parser.add_argument('-o', '--output', default=None,
+                        help="Write the results to a JSON file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    jobs = []
+    for spec in args.jobs:
+        rom, _, replay = spec.partition(',')
+        jobs += [Job(rom, replay or None, args.frames, args.interpret)] * args.instances
+
+    results = run_jobs(jobs, args.workers)
+    for result in results:
+        print("%-24s %-24s %6d frames %8.1f frames/s %s" % (
+            result['rom'], result['replay'] or '-', result['frames'],
+            result['frames_per_second'], result['sha1'] or 'FAILED'
+        ))
+        if result['error']:
+            print(result['error'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(any(result['error'] for result in results))
+
+
+if __name__ == '__main__':
+    main()
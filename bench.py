@@ -0,0 +1,213 @@
+import argparse
+import json
+import sys
+import time
+import cpu
+
+from devices import Display
+from disassembler import mnemonic
+from machine import Machine
+from profiler import Profiler
+
+CYCLES_PER_FRAME = Display().cycles_per_frame
+
+# ROM drawing a 16-row sprite over and over, the loop at 0202 is the one of
+# the Space Invaders DrawShiftedSprite routine at 1400
+SPRITE_ROM = bytes([
+    0x31, 0x00, 0x24,  # 0000 LXI SP,2400
+    0x21, 0x00, 0x30,  # 0003 LXI H,3000
+    0x11, 0x00, 0x01,  # 0006 LXI D,0100
+    0x06, 0x10,        # 0009 MVI B,10
+    0x3e, 0x03,        # 000b MVI A,03
+    0xcd, 0x00, 0x02,  # 000d CALL 0200
+    0xc3, 0x03, 0x00,  # 0010 JMP 0003
+]).ljust(0x100) + bytes(range(0x5a, 0x6a)).ljust(0x100) + bytes([
+    0xd3, 0x02,        # 0200 OUT 2
+    0xc5,              # 0202 PUSH B
+    0xe5,              # 0203 PUSH H
+    0x1a,              # 0204 LDAX D
+    0xd3, 0x04,        # 0205 OUT 4
+    0xdb, 0x03,        # 0207 IN 3
+    0xb6,              # 0209 ORA M
+    0x77,              # 020a MOV M,A
+    0x23,              # 020b INX H
+    0x13,              # 020c INX D
+    0xaf,              # 020d XRA A
+    0xd3, 0x04,        # 020e OUT 4
+    0xdb, 0x03,        # 0210 IN 3
+    0xb6,              # 0212 ORA M
+    0x77,              # 0213 MOV M,A
+    0xe1,              # 0214 POP H
+    0x01, 0x20, 0x00,  # 0215 LXI B,0020
+    0x09,              # 0218 DAD B
+    0xc1,              # 0219 POP B
+    0x05,              # 021a DCR B
+    0xc2, 0x02, 0x02,  # 021b JNZ 0202
+    0xc9,              # 021e RET
+]).ljust(0x1e00)
+
+
+def load_program(fname):
+    # same layout as tests.py: CP/M programs start at 0x100 and call 5 for output
+    with open(fname, 'rb') as f:
+        machine = Machine(bytes(0x100) + f.read(), ())
+    machine.state.memory[5] = 0xC9
+    machine.state.pc = 0x100
+    return machine
+
+
+def load_rom(fname):
+    """ Loads a Space Invaders ROM on a machine of its own """
+    with open(fname, 'rb') as f:
+        return Machine(f.read())
+
+
+def run_program(machine, cycles):
+    """
+    Runs a CP/M program for a number of cycles, the program restarts from
+    0100 every time it jumps back to 0000
+    """
+    machine.state.memory[0:3] = b'\xc3\x00\x01'  # JMP 0100
+    machine.engine.run(machine.state, cycles)
+
+
+def run_rom(machine, cycles):
+    """ Runs a ROM for a number of cycles, taking the display interrupts """
+    machine.run(cycles)
+
+
+def benchmark(fname, rom, cycles, interpret):
+    """
+    Runs a program for a number of cycles, once timed and once counting the
+    opcodes it executes; the workload is the same in both runs
+
+    Returns a dict of the results
+    """
+    load, run = (load_rom, run_rom) if rom else (load_program, run_program)
+
+    machine = load(fname)
+    if interpret:
+        machine.engine = cpu.Interpreter()
+    start = time.perf_counter()
+    run(machine, cycles)
+    elapsed = time.perf_counter() - start
+    executed = machine.state.cycles
+    frames = machine.display.frames if rom else executed / CYCLES_PER_FRAME
+
+    machine = load(fname)
+    machine.engine = profiler = Profiler(machine.state)
+    run(machine, cycles)
+    counts = profiler.opcode_counts
+    instructions = sum(counts)
+
+    return {
+        'program': fname,
+        'engine': 'interpreter' if interpret else 'translator',
+        'cycles': executed,
+        'frames': frames,
+        'instructions': instructions,
+        'elapsed': elapsed,
+        'instructions_per_second': instructions / elapsed,
+        'cycles_per_second': executed / elapsed,
+        'frames_per_second': frames / elapsed,
+        'opcodes': {'%02x' % opcode: n for opcode, n in enumerate(counts) if n},
+    }
+
+
+def sprite_benchmark(cycles, interpret, repeats=5):
+    """
+    Runs SPRITE_ROM for a number of cycles with the shift register on the
+    bus and fused with the state. Each machine first runs a tenth of the
+    cycles to translate its blocks, then the cycles are timed repeats times
+    and the fastest run is kept. The runs stop at different instructions,
+    blocks overshoot the cycles differently with and without fusing, so
+    only the video RAM they draw the sprite to is compared.
+
+    Returns a dict of the results
+    """
+    result = {'program': 'sprite', 'engine': 'interpreter' if interpret else 'translator',
+              'cycles': cycles, 'repeats': repeats}
+    screens = []
+    for fuse in (False, True):
+        machine = Machine(SPRITE_ROM, fuse=fuse)
+        if interpret:
+            machine.engine = cpu.Interpreter()
+        state = machine.state
+        machine.engine.run(state, cycles // 10)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            machine.engine.run(state, state.cycles + cycles)
+            times.append(time.perf_counter() - start)
+        result['fused' if fuse else 'bus'] = min(times)
+        screens.append(state.video_ram().tobytes())
+    result['speedup'] = result['bus'] / result['fused']
+    result['matches'] = screens[0] == screens[1]
+    return result
+
+
+def report(result, top):
+    print("%s (%s)" % (result['program'], result['engine']))
+    print("  %d cycles, %d instructions, %.0f frames in %.2fs" % (
+        result['cycles'], result['instructions'], result['frames'], result['elapsed']
+    ))
+    print("  %.0f instructions/s, %.0f cycles/s, %.1f frames/s" % (
+        result['instructions_per_second'], result['cycles_per_second'],
+        result['frames_per_second']
+    ))
+    opcodes = sorted(result['opcodes'].items(), key=lambda item: -item[1])
+    for opcode, n in opcodes[:top]:
+        print("  %s %-8s %10d %5.1f%%" % (
+            opcode, mnemonic(int(opcode, 16)), n, n / result['instructions'] * 100
+        ))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the emulator's throughput without rendering anything"
+    )
+    parser.add_argument('programs', nargs='*', help="Programs to execute")
+    budget = parser.add_mutually_exclusive_group()
+    budget.add_argument('-c', '--cycles', type=int, default=None,
+                        help="Number of cycles to execute per program")
+    budget.add_argument('-f', '--frames', type=int, default=600,
+                        help="Number of 60 Hz frames to execute per program")
+    parser.add_argument('-r', '--rom', action='store_true', default=False,
+                        help="Load the programs as Space Invaders ROMs instead of CP/M programs")
+    parser.add_argument('-i', '--interpret', action='store_true', default=False,
+                        help="Interpret every instruction instead of translating blocks of code")
+    parser.add_argument('-s', '--sprite', action='store_true', default=False,
+                        help="Time the sprite drawing routine with and without the fused shift register")
+    parser.add_argument('--repeats', type=int, default=5,
+                        help="Number of timed runs of the sprite routine, the fastest is reported")
+    parser.add_argument('-n', '--top', type=int, default=10,
+                        help="Number of opcodes of the histogram to display")
+    parser.add_argument('-o', '--output', default=None,
+                        help="Write the results to a JSON file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cycles = args.cycles or args.frames * CYCLES_PER_FRAME
+    results = []
+    for fname in args.programs:
+        result = benchmark(fname, args.rom, cycles, args.interpret)
+        report(result, args.top)
+        results.append(result)
+    if args.sprite:
+        result = sprite_benchmark(cycles, args.interpret, args.repeats)
+        print("sprite (%s)" % result['engine'])
+        print("  best of %d: bus %.3fs, fused %.3fs, %.2fx%s" % (
+            result['repeats'], result['bus'], result['fused'], result['speedup'],
+            '' if result['matches'] else ", video RAM differs"
+        ))
+        results.append(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
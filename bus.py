@@ -1,70 +1,141 @@
 from collections import deque
-from devices import devices
+from functools import partial
+from scheduler import Scheduler
 
-import pygame
 import sys
 
+# pygame key -> button of the controller, see buttons
+BUTTONS = None
 
-class Bus(object):
 
-    def __init__(self):
-        self.device_map_write = {
-            0x02: devices['shft_reg'].set_offset,
-            0x03: int,  # dummy
-            0x04: devices['shft_reg'].shift,
-            0x05: float,  # dummy
-            0x06: int,  # dummy
+def buttons():
+    """
+    Returns BUTTONS, built on first use so that pygame is only imported
+    when there are keys to map
+    """
+    global BUTTONS
+    if BUTTONS is None:
+        import pygame
+        BUTTONS = {
+            pygame.K_LEFT: 'mv_left_p1',
+            pygame.K_RIGHT: 'mv_right_p1',
+            pygame.K_RETURN: 'start_p1',
+            pygame.K_BACKSPACE: 'start_p2',
+            pygame.K_LCTRL: 'shoot_p1',
+            pygame.K_a: 'mv_left_p2',
+            pygame.K_d: 'mv_right_p2',
+            pygame.K_SPACE: 'shoot_p2',
+            pygame.K_c: 'add_credit',
         }
+    return BUTTONS
 
-        self.device_map_read = {
-            0x01: devices['ctrl'].get_p1,
-            0x02: devices['ctrl'].get_p2,
-            0x03: devices['shft_reg'].get_register,
-        }
 
-        self.interrupts = deque()
+def ignore(val):
+    """ Default handler of the output ports """
 
-    def write(self, adr, val):
-        self.device_map_write[adr](val)
 
-    def read(self, adr):
-        return self.device_map_read[adr]()
+def unmapped():
+    """ Default handler of the input ports """
+    return 0
+
+
+class Bus(object):
+    """
+    Connects the devices of a machine to the ports and interrupts of the CPU
+
+    Arguments:
+        shift_register (devices.ShiftRegister): on ports 2, 3 and 4
+        controller (devices.Controller): on ports 1 and 2
+        display (devices.Display): requests the interrupts
+    """
+
+    def __init__(self, shift_register, controller, display):
+        self.controller = controller
+
+        # handlers of every port, indexed by port number
+        self.writers = [ignore] * 0x100
+        self.readers = [unmapped] * 0x100
+
+        # last value written to every coalesced port since the last flush,
+        # and the handlers it's flushed to
+        self.latched = {}
+        self.coalesced = {}
+
+        self.register_write(0x02, shift_register.set_offset)
+        self.register_write(0x04, shift_register.shift)
+        # sound ports 3 and 5 aren't implemented, the game writes the
+        # watchdog on port 6 constantly
+        self.register_write(0x06, ignore, coalesce=True)
+
+        self.register_read(0x01, controller.get_p1)
+        self.register_read(0x02, controller.get_p2)
+        self.register_read(0x03, shift_register.get_register)
 
-    def loop(self, cycles):
-        refresh = devices['dspl'].refresh(cycles)
+        # pending interrupt, a new request replaces one the CPU didn't take
+        self.interrupts = deque(maxlen=1)
 
-        if refresh:
-            self.interrupts.extend(refresh)
-            # CPU clock tick
-            return True
-        return False
+        # keys held down and keys pressed since the last latch
+        self.held = set()
+        self.pressed = set()
+
+        self.scheduler = Scheduler()
+        display.start(self.scheduler, self.interrupts.append)
+        display.frame_hooks.append(self.flush)
+
+    def register_write(self, port, handler, coalesce=False):
+        """
+        Sets the handler of an output port, called with the value written
+
+        Writes to a coalesced port only latch the value, the handler gets
+        the last one at the next flush, once per frame
+        """
+        if coalesce:
+            self.coalesced[port] = handler
+            handler = partial(self.latched.__setitem__, port)
+        else:
+            self.coalesced.pop(port, None)
+        self.writers[port] = handler
+
+    def register_read(self, port, handler):
+        """ Sets the handler of an input port, returns the value read """
+        self.readers[port] = handler
+
+    def flush(self):
+        """ Passes the values latched by the coalesced ports to their handlers """
+        for port, val in self.latched.items():
+            self.coalesced[port](val)
+        self.latched.clear()
+
+    def write(self, adr, val):
+        self.writers[adr](val)
+
+    def read(self, adr):
+        return self.readers[adr]()
 
     def handle_events(self):
+        import pygame
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+            self.handle_event(event.type, getattr(event, 'key', None))
+
+    def handle_event(self, type, key):
+        import pygame
+        if type == pygame.QUIT:
+            sys.exit(0)
+        elif type == pygame.KEYDOWN:
+            if key == pygame.K_ESCAPE:
                 sys.exit(0)
-            elif event.type == pygame.KEYDOWN:
-                devices['ctrl'].reset()
-                if event.key == pygame.K_ESCAPE:
-                    sys.exit(0)
-                if event.key == pygame.K_LEFT:
-                    devices['ctrl'].mv_left_p1()
-                elif event.key == pygame.K_RIGHT:
-                    devices['ctrl'].mv_right_p1()
-                elif event.key == pygame.K_RETURN:
-                    devices['ctrl'].start_p1()
-                elif event.key == pygame.K_BACKSPACE:
-                    devices['ctrl'].start_p2()
-                elif event.key == pygame.K_LCTRL:
-                    devices['ctrl'].shoot_p1()
-                elif event.key == pygame.K_a:
-                    devices['ctrl'].mv_left_p2()
-                elif event.key == pygame.K_d:
-                    devices['ctrl'].mv_right_p2()
-                elif event.key == pygame.K_SPACE:
-                    devices['ctrl'].shoot_p2()
-                elif event.key == pygame.K_c:
-                    devices['ctrl'].add_credit()
-
-
-bus = Bus()
+            self.held.add(key)
+            self.pressed.add(key)
+        elif type == pygame.KEYUP:
+            self.held.discard(key)
+
+    def latch_input(self):
+        """
+        Latches the buttons into the controller, keys tapped during the frame
+        count as held so that they aren't lost
+        """
+        keys = self.held | self.pressed
+        self.pressed.clear()
+        mapping = buttons() if keys else {}
+        self.controller.latch(mapping[key] for key in keys if key in mapping)
+
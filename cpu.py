@@ -1,81 +1,118 @@
 import argparse
+import hashlib
+import linecache
 import numpy as np
-import pygame
 import time
 import sys
 
 from disassembler import disassemble
-from bus import bus
+from pacer import Pacer
+from memmap import MemoryMap, PAGE_ROM, PAGE_VIDEO, PAGE_MIRROR, PAGE_MIRRORED, PAGE_CODE
+from bus import ignore, unmapped
 
 # flake8: noqa
 
 
-def merge_bytes(high, low):
-    """
-    Merges two separate bytes to create an address
-
-    e.g.:
-        param high is 0x3E
-        param low is 0xFF
-        resulting address will be 0x3EFF
-    """
-    return (high << 8) | low
+def parity(n):
+    """ Sets the parity bit for the Flags construct """
+    return (bin(n).count('1') % 2) == 0
 
 
-def extract_bytes(adr):
-    """
-    Splits an address into two words
+# PSW flag bits
+FLAG_S = 0x80
+FLAG_Z = 0x40
+FLAG_AC = 0x10
+FLAG_P = 0x04
+FLAG_CY = 0x01
 
-    e.g.:
-        param adr is 0x3EFF
-        resulting values are 0x3E (high) and 0xFF (low)
-    """
-    return (adr >> 8) & 0xff, adr & 0xff
+# Zero, sign and parity bits of every byte value, laid out as in the PSW
+ZSP = bytes(
+    (FLAG_Z if n == 0 else 0) | (n & FLAG_S) | (FLAG_P if parity(n) else 0)
+    for n in range(0x100)
+)
 
+# Zero, sign, parity and carry bits of every 9-bit sum
+ZSPC = bytes(ZSP[n & 0xff] | (n >> 8) for n in range(0x200))
 
-def get_twos_comp(byte):
-    return (byte ^ 0xff) + 0x01
+# Flags left by a comparison, indexed by the 9-bit sum of A and the two's
+# complement of the operand; parity is taken over all 9 bits
+CMP_FLAGS = bytes(
+    ZSP[n & 0xff] ^ (FLAG_P if n > 0xff else 0) | (FLAG_CY if n <= 0xff else 0)
+    for n in range(0x200)
+)
 
 
-def get_msb(byte):
-    return byte >> 4
+class Flags:
+    """ Read-only view over a packed flag byte, used for debug output """
 
+    __slots__ = ('f',)
 
-def get_lsb(byte):
-    return byte & 0xf
+    def __init__(self, f):
+        self.f = f
 
+    @property
+    def z(self):
+        return (self.f >> 6) & 1
 
-def parity(n):
-    """ Sets the parity bit for the Flags construct """
-    return (bin(n).count('1') % 2) == 0
+    @property
+    def s(self):
+        return self.f >> 7
 
+    @property
+    def p(self):
+        return (self.f >> 2) & 1
 
-class Flags:
+    @property
+    def cy(self):
+        return self.f & FLAG_CY
 
-    def __init__(self):
-        self.z = 0
-        self.s = 0
-        self.p = 0
-        self.cy = 0
-        self.ac = 0
+    @property
+    def ac(self):
+        return (self.f >> 4) & 1
 
     def __int__(self):
-        byte = self.cy
-        byte |= 0x02
-        byte |= self.p << 2
-        byte |= self.ac << 4
-        byte |= self.z << 6
-        byte |= self.s << 7
-        return byte
+        return self.f | 0x02
+
+
+# Space Invaders video RAM, a 1 bit per pixel bitmap of the rotated screen
+VIDEO_RAM = 0x2400
+VIDEO_RAM_SIZE = 0x1c00
+VIDEO_RAM_END = VIDEO_RAM + VIDEO_RAM_SIZE
+SCREEN_WIDTH = 224
+SCREEN_HEIGHT = 256
+
+# (name, start, end, page flags, mirrored range) of the Space Invaders
+# memory regions, see memmap.MemoryMap
+MEMORY_MAP = [
+    ('ROM', 0x0000, 0x2000, PAGE_ROM, None),
+    ('work RAM', 0x2000, VIDEO_RAM, 0, None),
+    ('video RAM', VIDEO_RAM, VIDEO_RAM_END, PAGE_VIDEO, None),
+    ('RAM mirror', 0x4000, 0x10000, PAGE_MIRROR, (0x2000, 0x4000)),
+]
+
+# colours of the off and on pixels
+PALETTE = np.array([[0, 0, 0], [255, 255, 255]], dtype=np.uint8)
 
 
 class State:
 
-    def __init__(self, memory):
+    __slots__ = (
+        'memory', 'a', 'f', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc',
+        'int_enable', 'cycles', 'frame', 'dirty', 'map', 'pages', 'mirrors', 'invalidate', 'decoded',
+        'readers', 'writers', 'shifter',
+    )
+
+    def __init__(self, memory, regions=()):
+        """
+        Arguments:
+            memory (bytes): contents of the start of the memory
+            regions (list): region descriptors of the memory map, the memory
+                is all RAM without them
+        """
         rom = bytearray(memory)
         self.memory = rom + bytearray(0x10000 - len(rom))  # ROM + RAM
         self.a = 0
-        self._cc = Flags()
+        self.f = 0
         self.b = 0
         self.c = 0
         self.d = 0
@@ -86,358 +123,795 @@ class State:
         self.pc = 0
         self.int_enable = 0
         self.cycles = 0
-
-    def calc_flags(self, ans, single=True):
-        mask = 0xff if single else 0xffff
-        self.cc.z = (ans & mask) == 0
-        self.cc.s = (ans & (mask - (mask >> 1))) != 0
-        self.cc.cy = ans > mask
-        self.cc.p = parity(ans & mask)
-
-    def nop(self):
-        self.cycles += 4
-
-    def push(self, reg):
+        self.frame = None
+        # one flag per 32-byte row of video RAM (a column of the screen)
+        # that was written since it was last rasterized
+        self.dirty = bytearray(b'\x01' * SCREEN_WIDTH)
+        self.map = MemoryMap(regions, len(self.memory))
+        self.pages = self.map.pages
+        self.mirrors = self.map.mirrors
+        # called with the address of the writes to pages holding translated code
+        self.invalidate = None
+        # shift register the OUT and IN instructions of its ports are fused
+        # with, see fuse
+        self.shifter = None
+        # (handler, arg1, arg2) of the instruction at every address of the
+        # ROM at the start of the memory, see predecode
+        self.predecode(self.map.rom_size())
+        # handlers of the input and output ports, replaced by the ones of the
+        # bus of a machine.Machine
+        self.readers = [unmapped] * 0x100
+        self.writers = [ignore] * 0x100
+
+    def predecode(self, size):
         """
-        Push a register pair onto the stack.
-
-        Arguments:
-            reg (str): register pair name [bc|de|hl|psw|pc]
+        Decodes the instruction at every address of the first size bytes of
+        memory, so that executing them takes a single lookup. These bytes must
+        be ROM, the decoded instructions aren't updated when memory is written
         """
-        assert reg in 'bc de hl psw pc'.split(), "Register %s is not valid" % reg
+        memory = self.memory
+        fused = FUSED if self.shifter is not None else {}
+        self.decoded = [(fused.get((memory[pc], memory[pc + 1]), DISPATCH[memory[pc]]),
+                         memory[pc + 1], memory[pc + 2])
+                        for pc in range(size)]
 
-        self.memory[self.sp - 1], self.memory[self.sp - 2] = extract_bytes(getattr(self, reg))
-        self.sp -= 2
-        self.cycles += 11
-
-    def pop(self, reg):
+    def fuse(self, shifter):
         """
-        Pop a value from the stack into a register pair.
-
-        Arguments:
-            reg (str): register pair name [bc|de|hl|psw]
+        Decodes the OUT 2, OUT 4 and IN 3 instructions of the ROM to handlers
+        working on a shift register directly instead of going through the
+        port handlers, or back to the plain ones when shifter is None. The
+        translators created afterwards inline the fused handlers too.
         """
-        assert reg in 'bc de hl psw'.split(), "Register %s is not valid" % reg
-
-        setattr(self, reg, merge_bytes(self.memory[self.sp + 1], self.memory[self.sp]))
-        self.sp += 2
-        self.cycles += 10
+        self.shifter = shifter
+        self.predecode(len(self.decoded))
 
-    def lxi(self, reg, high, low):
+    def write(self, adr, value):
         """
-        Set a register pair to the specified bytes
-
-        Arguments:
-            reg (str): register pair name [bc|de|hl|psw|sp]
-            high (int): high byte
-            low (int): low byte
+        Stores a byte to the pages the opcode handlers don't store to
+        themselves, see store. The writes to a mirror go to the page it
+        repeats, and the writes to a page repeated by mirrors are copied to
+        them, so that the mirror reads the same bytes.
         """
-        assert reg in 'bc de hl psw sp'.split(), "Register %s is not valid" % reg
-
-        setattr(self, reg, merge_bytes(high, low))
-        self.pc += 2
-        self.cycles += 10
-
-    def dcr(self, reg):
-        """
-        Decrease the specified register by 1
-
-        Arguments:
-            reg (str): register name [a|b|c|d|e|h|l|m]
-        """
-        assert reg in 'b c d e h l m a'.split(), "Register %s is not valid" % reg
-
-        x = self.memory[self.hl] if reg == 'm' else getattr(self, reg)
-        ans = x - 1
-
-        self.cc.ac = (get_lsb(x) - 1) > 0xf
-        self.cc.z = (ans & 0xff) == 0
-        self.cc.s = (ans & 0x80) != 0
-        self.cc.p = parity(ans & 0xff)
-
-        if reg == 'm':
-            self.memory[self.hl] = ans & 0xff
-            self.cycles += 10
-        else:
-            setattr(self, reg, ans & 0xff)
-            self.cycles += 5
-
-    def mvi(self, reg, val):
-        if reg == 'm':
-            self.memory[self.hl] = val
-            self.cycles += 10
-        else:
-            setattr(self, reg, val)
-            self.cycles += 7
-        self.pc += 1
-
-    def dad(self, reg):
-        ans = self.hl + getattr(self, reg)
-        self.cc.cy = ans > 0xffff
-        self.hl = ans
-        self.cycles += 10
-
-    def inx(self, reg):
-        ans = getattr(self, reg) + 1
-        setattr(self, reg, ans & 0xffff)
-        self.cycles += 5
-
-    def dcx(self, reg):
-        ans = getattr(self, reg) - 1
-        setattr(self, reg, ans & 0xffff)
-        self.cycles += 5
-
-    def inr(self, reg):
-        x = self.memory[self.hl] if reg == 'm' else getattr(self, reg)
-        ans = x + 1
-
-        self.cc.ac = (get_lsb(x) + 1) > 0xf
-        self.cc.z = (ans & 0xff) == 0
-        self.cc.s = (ans & 0x80) != 0
-        self.cc.p = parity(ans & 0xff)
-
-        if reg == 'm':
-            self.memory[self.hl] = ans & 0xff
-            self.cycles += 10
-        else:
-            setattr(self, reg, ans & 0xff)
-            self.cycles += 5
-
-    def add(self, reg, carry=False):
-        if isinstance(reg, int):
-            self.cycles += 7
-        elif reg == 'm':
-            reg = self.memory[self.hl]
-            self.cycles += 7
-        else:
-            reg = getattr(self, reg)
-            self.cycles += 4
-        reg += 0 if not carry else self.cc.cy
-        self.cc.ac = (get_lsb(reg) + get_lsb(self.a)) > 0xf
-        ans = reg + self.a
-        self.calc_flags(ans)
-        self.a = ans & 0xff
-
-    def adc(self, reg):
-        self.add(reg, True)
-
-    def sub(self, reg, carry=False):
-        if isinstance(reg, int):
-            x = reg if not carry else reg + self.cc.cy
-            self.cycles += 7
-        elif reg == 'm':
-            x = self.memory[self.hl] if not carry else self.memory[self.hl] + self.cc.cy
-            self.cycles += 7
-        else:
-            x = getattr(self, reg) if not carry else getattr(self, reg) + self.cc.cy
-            self.cycles += 4
-        # two's complement
-        x = get_twos_comp(x)
-        self.cc.ac = (get_lsb(x) + get_lsb(self.a)) > 0xf
-        ans = self.a + x
-        self.cc.cy = ans <= 0xff
-        self.cc.s = (ans & 0x80) != 0
-        self.cc.z = (ans & 0xff) == 0
-        self.cc.p = parity(ans & 0xff)
-        self.a = ans & 0xff
-
-    def sbb(self, reg):
-        self.sub(reg, True)
-
-    def ana(self, reg):
-        if isinstance(reg, int):
-            self.cycles += 7
-        elif reg == 'm':
-            reg = self.memory[self.hl]
-            self.cycles += 7
-        else:
-            reg = getattr(self, reg)
-            self.cycles += 4
-
-        self.cc.ac = (get_lsb(reg) + get_lsb(self.a)) > 0xf
-        ans = self.a & reg
-        self.calc_flags(ans)
-        self.a = ans & 0xff
-
-    def ora(self, reg):
-        if isinstance(reg, int):
-            ans = self.a | reg
-            self.cycles += 7
-        elif reg == 'm':
-            ans = self.a | self.memory[self.hl]
-            self.cycles += 7
-        else:
-            ans = self.a | getattr(self, reg)
-            self.cycles += 4
-
-        self.cc.ac = 0
-        self.calc_flags(ans)
-        self.a = ans & 0xff
-
-    def xra(self, reg):
-        if isinstance(reg, int):
-            ans = self.a ^ reg
-            self.cycles += 7
-        elif reg == 'm':
-            ans = self.a ^ self.memory[self.hl]
-            self.cycles += 7
-        else:
-            ans = self.a ^ getattr(self, reg)
-            self.cycles += 4
-
-        self.cc.ac = 0
-        self.calc_flags(ans)
-        self.a = ans & 0xff
-
-    def cmp(self, reg):
-        if isinstance(reg, int):
-            tc_val = get_twos_comp(reg)
-            self.cycles += 7
-        elif reg == 'm':
-            tc_val = get_twos_comp(self.memory[self.hl])
-            self.cycles += 7
-        else:
-            tc_val = get_twos_comp(getattr(self, reg))
-            self.cycles += 4
-        self.cc.ac = (get_lsb(self.a) + get_lsb(tc_val)) > 0xf
-        ans = self.a + tc_val
-        self.cc.cy = ans <= 0xff
-        self.cc.z = (ans & 0xff) == 0x00
-        self.cc.s = (ans & 0x80) != 0
-        self.cc.p = parity(ans)
-
-    def stax(self, reg):
-        self.memory[getattr(self, reg)] = self.a
-        self.cycles += 7
-
-    def rst(self, i):
-        self.int_enable = 0
-        self.push('pc')
-        self.pc = 8 * i
-        self.cycles += 11
-
-    def jmp(self, adr, cc=None, opposite=False):
-        if cc:
-            cc = getattr(self.cc, cc)
-            # generalization for FLAG/NOTFLAG
-            if bool(cc) != opposite:
-                self.pc = adr
-            else:
-                self.pc += 3
-        else:
-            self.pc = adr
-        self.cycles += 10
-
-    def ret(self, cc=None, opposite=False):
-        if cc:
-            cc = getattr(self.cc, cc)
-            if bool(cc) != opposite:
-                self.pc = merge_bytes(self.memory[self.sp + 1], self.memory[self.sp])
-                self.sp += 2
-                self.cycles += 11
-            else:
-                self.cycles += 5
-                self.pc += 1
-        else:
-            self.pc = merge_bytes(self.memory[self.sp + 1], self.memory[self.sp])
-            self.sp += 2
-            self.cycles += 10
-
-    def call(self, adr, cc=None, opposite=False):
-        if cc:
-            cc = getattr(self.cc, cc)
-            if bool(cc) != opposite:
-                self.cycles += 17
-                ret = self.pc + 3
-                hi, lo = extract_bytes(ret)
-                self.memory[self.sp - 1] = hi
-                self.memory[self.sp - 2] = lo
-                self.sp -= 2
-                self.pc = adr
-            else:
-                self.cycles += 11
-                self.pc += 3
-        else:
-            self.cycles += 17
-            ret = self.pc + 3
-            hi, lo = extract_bytes(ret)
-            self.memory[self.sp - 1] = hi
-            self.memory[self.sp - 2] = lo
-            self.sp -= 2
-            self.pc = adr
+        page = self.pages[adr >> 8]
+        if page & PAGE_MIRROR:
+            adr = (self.map.targets[adr >> 8] << 8) | (adr & 0xff)
+            page = self.pages[adr >> 8]
+        if page & PAGE_ROM:
+            return
+        self.memory[adr] = value
+        if page & PAGE_VIDEO:
+            self.dirty[(adr - VIDEO_RAM) >> 5] = 1
+        if page & PAGE_CODE:
+            self.invalidate(adr)
+        if page & PAGE_MIRRORED:
+            offset, end, step, fill = self.mirrors[adr >> 8]
+            self.memory[adr + offset:end:step] = fill[value]
 
     @property
     def cc(self):
-        return self._cc
+        return Flags(self.f)
 
     @cc.setter
     def cc(self, val):
-        self._cc.cy = (val & 0x01) != 0
-        self._cc.p = (val & 0x04) != 0
-        self._cc.ac = (val & 0x10) != 0
-        self._cc.z = (val & 0x40) != 0
-        self._cc.s = (val & 0x80) != 0
+        self.f = val & (FLAG_S | FLAG_Z | FLAG_AC | FLAG_P | FLAG_CY)
 
     @property
     def psw(self):
-        return merge_bytes(self.a, int(self.cc))
+        return (self.a << 8) | self.f | 0x02
 
     @psw.setter
     def psw(self, val):
-        self.a, self.cc = extract_bytes(val)
+        self.a = (val >> 8) & 0xff
+        self.f = val & (FLAG_S | FLAG_Z | FLAG_AC | FLAG_P | FLAG_CY)
 
     @property
     def bc(self):
-        return merge_bytes(self.b, self.c)
+        return (self.b << 8) | self.c
 
     @bc.setter
     def bc(self, val):
-        self.b, self.c = extract_bytes(val)
+        self.b = (val >> 8) & 0xff
+        self.c = val & 0xff
 
     @property
     def de(self):
-        return merge_bytes(self.d, self.e)
+        return (self.d << 8) | self.e
 
     @de.setter
     def de(self, val):
-        self.d, self.e = extract_bytes(val)
+        self.d = (val >> 8) & 0xff
+        self.e = val & 0xff
 
     @property
     def hl(self):
-        return merge_bytes(self.h, self.l)
+        return (self.h << 8) | self.l
 
     @hl.setter
     def hl(self, val):
-        self.h, self.l = extract_bytes(val)
+        self.h = (val >> 8) & 0xff
+        self.l = val & 0xff
+
+    def video_ram(self):
+        """ Returns a (224, 32) array viewing the video RAM in memory """
+        return np.frombuffer(self.memory, dtype=np.uint8, count=VIDEO_RAM_SIZE,
+                             offset=VIDEO_RAM).reshape(SCREEN_WIDTH, 32)
 
     def rasterize(self):
+        """
+        Converts the video RAM into a (224, 256, 3) array of pixels
+
+        The array is allocated on the first call and reused afterwards
+        """
+        if self.frame is None:
+            self.frame = np.empty((SCREEN_WIDTH, SCREEN_HEIGHT, 3), dtype=np.uint8)
+        rasterize(self.video_ram(), self.frame, [(0, SCREEN_WIDTH)])
+        self.dirty[:] = bytes(SCREEN_WIDTH)
+        return self.frame
+
+
+def dirty_spans(dirty):
+    """ Splits the dirty row flags into (start, end) ranges of dirty rows """
+    rows = np.flatnonzero(np.frombuffer(dirty, dtype=np.uint8))
+    if not len(rows):
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1)
+    starts = rows[np.concatenate(([0], breaks + 1))]
+    ends = rows[np.concatenate((breaks, [len(rows) - 1]))] + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def rasterize(video_ram, frame, spans, palette=PALETTE):
+    """
+    Converts rows of video RAM into pixels
+
+    Arguments:
+        video_ram (np.ndarray): (224, 32) bytes of video RAM
+        frame (np.ndarray): (224, 256) array of pixels to update, followed
+            by the dimensions of the entries of palette
+        spans (list): (start, end) ranges of the rows to convert
+        palette (np.ndarray): pixels of the unlit and lit bits
+    """
+    for start, end in spans:
+        # every 32 bytes hold a column of the (rotated) screen, starting
+        # with the least significant bit at the bottom
+        bits = np.unpackbits(video_ram[start:end], axis=1, bitorder='little')
+        np.take(palette, bits[:, ::-1], axis=0, out=frame[start:end], mode='clip')
+
+
+# Opcode handlers, every handler takes the state and the two bytes following
+# the opcode and is responsible for advancing the program counter
+DISPATCH = [None] * 256
+
+# register operands, in the order of the 8080's 3-bit register field
+REGISTERS = 'b c d e h l m a'.split()
+OPERANDS = [
+    'state.b', 'state.c', 'state.d', 'state.e', 'state.h', 'state.l',
+    'state.memory[(state.h << 8) | state.l]', 'state.a',
+]
+
+# (name, read, write) sources of the register pairs, in the order of the
+# 8080's 2-bit pair field, the write source stores the value of n
+PAIRS = [
+    ('bc', '((state.b << 8) | state.c)', 'state.b, state.c = n >> 8, n & 0xff'),
+    ('de', '((state.d << 8) | state.e)', 'state.d, state.e = n >> 8, n & 0xff'),
+    ('hl', '((state.h << 8) | state.l)', 'state.h, state.l = n >> 8, n & 0xff'),
+    ('sp', 'state.sp', 'state.sp = n'),
+]
+STACK_PAIRS = PAIRS[:3] + [
+    ('psw', '((state.a << 8) | state.f | 0x02)', 'state.a, state.f = n >> 8, n & 0xd5'),
+]
+
+# (name, flag mask, expected value) of the branch conditions
+CONDITIONS = [
+    ('nz', FLAG_Z, 0), ('z', FLAG_Z, FLAG_Z), ('nc', FLAG_CY, 0), ('c', FLAG_CY, FLAG_CY),
+    ('po', FLAG_P, 0), ('pe', FLAG_P, FLAG_P), ('p', FLAG_S, 0), ('m', FLAG_S, FLAG_S),
+]
+
+
+def opcode(*codes):
+    """ Registers the decorated function as the handler of the given opcodes """
+    def register(handler):
+        for code in codes:
+            DISPATCH[code] = handler
+        return handler
+    return register
+
+
+def specialise(name, template, **fields):
+    """
+    Compiles a handler from a source template, registers and operands are
+    substituted in the source so the handler doesn't need to look them up
+    when it's executed.
+
+    Arguments:
+        name (str): name of the resulting handler
+        template (str): body of the handler
+        fields: values substituted in the template
+    """
+    body = template.format(**fields).strip('\n')
+    source = 'def %s(state, arg1, arg2):\n%s\n' % (name, body)
+    filename = '<%s>' % name
+    # keep the source around for tracebacks and inspect.getsource
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = {}
+    exec(compile(source, filename, 'exec'), globals(), namespace)
+    return namespace[name]
+
+
+def store(adr, value, indent='    '):
+    """
+    Source of a memory write, the page table sends the writes to pages other
+    than plain and video RAM and the RAM repeated by a mirror through
+    State.write. Writes to the video RAM also mark the row they fall in as
+    dirty, writes to mirrored RAM update the copies of the mirror.
+
+    Arguments:
+        adr (str): name of the variable holding the address
+        value (str): source of the value
+        indent (str): indentation of the statement
+    """
+    return ('\n' + indent).join([
+        'page = state.pages[%s >> 8]' % adr,
+        'if not page:',
+        '    state.memory[%s] = %s' % (adr, value),
+        'elif page == PAGE_VIDEO:',
+        '    state.memory[%s] = %s' % (adr, value),
+        '    state.dirty[(%s - VIDEO_RAM) >> 5] = 1' % adr,
+        'elif page | PAGE_VIDEO == PAGE_VIDEO | PAGE_MIRRORED:',
+        '    offset, end, step, fill = state.mirrors[%s >> 8]' % adr,
+        '    state.memory[%s] = %s' % (adr, value),
+        '    state.memory[%s + offset:end:step] = fill[%s]' % (adr, value),
+        '    if page & PAGE_VIDEO:',
+        '        state.dirty[(%s - VIDEO_RAM) >> 5] = 1' % adr,
+        'else:',
+        '    state.write(%s, %s)' % (adr, value),
+    ])
+
+
+def assign(reg, value):
+    """
+    Source of an assignment to one of the registers in REGISTERS, or to the
+    memory pointed by HL for M
+    """
+    if reg == 'm':
+        return 'adr = (state.h << 8) | state.l\n    ' + store('adr', value)
+    return 'state.%s = %s' % (reg, value)
+
+
+def push(value, indent='    '):
+    """ Source pushing a 16-bit value onto the stack """
+    return ('\n' + indent).join([
+        'n = %s' % value,
+        'adr = state.sp - 1',
+        store('adr', '(n >> 8) & 0xff', indent),
+        'adr -= 1',
+        store('adr', 'n & 0xff', indent),
+        'state.sp -= 2',
+    ])
+
+
+LXI = '''
+    n = (arg2 << 8) | arg1
+    {write}
+    state.cycles += 10
+    state.pc += 3
+'''
+
+STAX = '''
+    adr = {read}
+    {store}
+    state.cycles += 7
+    state.pc += 1
+'''
+
+LDAX = '''
+    state.a = state.memory[{read}]
+    state.cycles += 7
+    state.pc += 1
+'''
+
+INX = '''
+    n = ({read} + 1) & 0xffff
+    {write}
+    state.cycles += 5
+    state.pc += 1
+'''
+
+DCX = '''
+    n = ({read} - 1) & 0xffff
+    {write}
+    state.cycles += 5
+    state.pc += 1
+'''
+
+DAD = '''
+    ans = ((state.h << 8) | state.l) + {read}
+    state.f = (state.f & ~FLAG_CY) | (ans > 0xffff)
+    state.h, state.l = (ans >> 8) & 0xff, ans & 0xff
+    state.cycles += 10
+    state.pc += 1
+'''
+
+for i, (pair, read, write) in enumerate(PAIRS):
+    DISPATCH[0x01 | i << 4] = specialise('op_lxi_' + pair, LXI, write=write)
+    DISPATCH[0x03 | i << 4] = specialise('op_inx_' + pair, INX, read=read, write=write)
+    DISPATCH[0x09 | i << 4] = specialise('op_dad_' + pair, DAD, read=read)
+    DISPATCH[0x0b | i << 4] = specialise('op_dcx_' + pair, DCX, read=read, write=write)
+
+for i, (pair, read, write) in enumerate(PAIRS[:2]):
+    DISPATCH[0x02 | i << 4] = specialise('op_stax_' + pair, STAX, read=read,
+                                         store=store('adr', 'state.a'))
+    DISPATCH[0x0a | i << 4] = specialise('op_ldax_' + pair, LDAX, read=read)
+
+
+INR = '''
+    x = {reg}
+    ans = (x + 1) & 0xff
+    state.f = (state.f & FLAG_CY) | ZSP[ans] | (((x & 0xf) + 1) & FLAG_AC)
+    {assign}
+    state.cycles += {cycles}
+    state.pc += 1
+'''
+
+# the low nibble can't overflow when decreasing, so aux-carry is cleared
+DCR = '''
+    ans = ({reg} - 1) & 0xff
+    state.f = (state.f & FLAG_CY) | ZSP[ans]
+    {assign}
+    state.cycles += {cycles}
+    state.pc += 1
+'''
+
+MVI = '''
+    {assign}
+    state.cycles += {cycles}
+    state.pc += 2
+'''
+
+for i, (reg, operand) in enumerate(zip(REGISTERS, OPERANDS)):
+    cycles = 10 if reg == 'm' else 5
+    DISPATCH[0x04 | i << 3] = specialise('op_inr_' + reg, INR, reg=operand,
+                                         assign=assign(reg, 'ans'), cycles=cycles)
+    DISPATCH[0x05 | i << 3] = specialise('op_dcr_' + reg, DCR, reg=operand,
+                                         assign=assign(reg, 'ans'), cycles=cycles)
+    DISPATCH[0x06 | i << 3] = specialise('op_mvi_' + reg, MVI, assign=assign(reg, 'arg1'),
+                                         cycles=10 if reg == 'm' else 7)
+
+
+@opcode(0x00, 0x08, 0x10, 0x18, 0x20, 0x28, 0x30, 0x38)
+def op_nop(state, arg1, arg2):
+    # NOP, NOP*
+    state.cycles += 4
+    state.pc += 1
+
+
+@opcode(0x07)
+def op_rlc(state, arg1, arg2):
+    # RLC
+    h = state.a >> 7
+    state.f = (state.f & ~FLAG_CY) | h
+    state.a = ((state.a << 1) & 0xff) | h
+    state.cycles += 4
+    state.pc += 1
+
+
+@opcode(0x0f)
+def op_rrc(state, arg1, arg2):
+    # RRC
+    x = state.a
+    state.a = ((x & 1) << 7) | (x >> 1)
+    state.f = (state.f & ~FLAG_CY) | (x & 1)
+    state.cycles += 4
+    state.pc += 1
+
+
+@opcode(0x17)
+def op_ral(state, arg1, arg2):
+    # RAL
+    x = state.a
+    state.a = ((x << 1) & 0xff) | (state.f & FLAG_CY)
+    state.f = (state.f & ~FLAG_CY) | (x >> 7)
+    state.cycles += 4
+    state.pc += 1
+
+
+@opcode(0x1f)
+def op_rar(state, arg1, arg2):
+    # RAR
+    x = state.a
+    state.a = ((state.f & FLAG_CY) << 7) | (x >> 1)
+    state.f = (state.f & ~FLAG_CY) | (x & 1)
+    state.cycles += 4
+    state.pc += 1
+
+
+SHLD = '''
+    adr = (arg2 << 8) | arg1
+    {store_l}
+    adr += 1
+    {store_h}
+    state.cycles += 16
+    state.pc += 3
+'''
+
+DISPATCH[0x22] = specialise('op_shld', SHLD, store_l=store('adr', 'state.l'),
+                            store_h=store('adr', 'state.h'))
+
+
+@opcode(0x27)
+def op_daa(state, arg1, arg2):
+    # DAA
+    ac = state.f & FLAG_AC
+    lsb = state.a & 0x0f
+    if lsb > 9 or ac:
+        state.a = (state.a + 0x06) & 0xff
+        ac = (lsb + 0x06) & FLAG_AC
+    msb = state.a >> 4
+    if msb > 9 or state.f & FLAG_CY:
+        state.a = (state.a + 0x60) & 0xff
+        cy = (msb + 0x06) > 0x0f
+    else:
+        cy = 0
+    state.f = ZSP[state.a] | ac | cy
+    state.cycles += 4
+    state.pc += 1
+
+
+@opcode(0x2a)
+def op_lhld(state, arg1, arg2):
+    # LHLD adr
+    adr = (arg2 << 8) | arg1
+    state.l = state.memory[adr]
+    state.h = state.memory[adr + 1]
+    state.cycles += 16
+    state.pc += 3
+
+
+@opcode(0x2f)
+def op_cma(state, arg1, arg2):
+    # CMA
+    # python's ~ operator uses signed not, we want unsigned not
+    state.a ^= 0xff
+    state.cycles += 4
+    state.pc += 1
+
+
+STA = '''
+    adr = (arg2 << 8) | arg1
+    {store}
+    state.cycles += 13
+    state.pc += 3
+'''
+
+DISPATCH[0x32] = specialise('op_sta', STA, store=store('adr', 'state.a'))
+
 
-        def bitarray(byte):
-            bits = [[0, 0, 0]] * 8
-            for i in range(len(bits)):
-                if byte & 1:
-                    bits[i] = [255, 255, 255]
-                byte >>= 1
-            return list(reversed(bits))
+@opcode(0x37)
+def op_stc(state, arg1, arg2):
+    # STC
+    state.f |= FLAG_CY
+    state.cycles += 4
+    state.pc += 1
+
+
+@opcode(0x3a)
+def op_lda(state, arg1, arg2):
+    # LDA adr
+    state.a = state.memory[(arg2 << 8) | arg1]
+    state.cycles += 13
+    state.pc += 3
+
+
+@opcode(0x3f)
+def op_cmc(state, arg1, arg2):
+    # CMC
+    state.f ^= FLAG_CY
+    state.pc += 1
+
+
+MOV = '''
+    {assign}
+    state.cycles += {cycles}
+    state.pc += 1
+'''
+
+for i, dst in enumerate(REGISTERS):
+    for j, (src, src_operand) in enumerate(zip(REGISTERS, OPERANDS)):
+        if dst != 'm' or src != 'm':
+            DISPATCH[0x40 | i << 3 | j] = specialise(
+                'op_mov_%s_%s' % (dst, src), MOV, assign=assign(dst, src_operand),
+                cycles=7 if 'm' in (dst, src) else 5
+            )
+
+
+@opcode(0x76)
+def op_hlt(state, arg1, arg2):
+    # HLT
+    state.cycles = 7
+    sys.exit(0)
+
+
+ADD = '''
+    x = {src}
+    ans = state.a + x
+    state.f = ZSPC[ans] | (((x & 0xf) + (state.a & 0xf)) & FLAG_AC)
+    state.a = ans & 0xff
+'''
+
+ADC = '''
+    x = {src} + (state.f & FLAG_CY)
+    ans = state.a + x
+    state.f = ZSPC[ans] | (((x & 0xf) + (state.a & 0xf)) & FLAG_AC)
+    state.a = ans & 0xff
+'''
+
+# subtractions add the two's complement of the operand
+SUB = '''
+    x = ({src} ^ 0xff) + 1
+    ans = state.a + x
+    state.f = ZSP[ans & 0xff] | (ans <= 0xff) | (((x & 0xf) + (state.a & 0xf)) & FLAG_AC)
+    state.a = ans & 0xff
+'''
+
+SBB = '''
+    x = (({src} + (state.f & FLAG_CY)) ^ 0xff) + 1
+    ans = state.a + x
+    state.f = ZSP[ans & 0xff] | (ans <= 0xff) | (((x & 0xf) + (state.a & 0xf)) & FLAG_AC)
+    state.a = ans & 0xff
+'''
+
+ANA = '''
+    x = {src}
+    ans = state.a & x
+    state.f = ZSP[ans] | (((x & 0xf) + (state.a & 0xf)) & FLAG_AC)
+    state.a = ans
+'''
+
+XRA = '''
+    state.a ^= {src}
+    state.f = ZSP[state.a]
+'''
+
+ORA = '''
+    state.a |= {src}
+    state.f = ZSP[state.a]
+'''
+
+CMP = '''
+    x = ({src} ^ 0xff) + 1
+    ans = state.a + x
+    state.f = CMP_FLAGS[ans] | (((state.a & 0xf) + (x & 0xf)) & FLAG_AC)
+'''
+
+ALU_OPERAND = '''
+    state.cycles += {cycles}
+    state.pc += {size}
+'''
+
+for i, (name, template) in enumerate([('add', ADD), ('adc', ADC), ('sub', SUB), ('sbb', SBB),
+                                      ('ana', ANA), ('xra', XRA), ('ora', ORA), ('cmp', CMP)]):
+    for j, (reg, operand) in enumerate(zip(REGISTERS, OPERANDS)):
+        DISPATCH[0x80 | i << 3 | j] = specialise(
+            'op_%s_%s' % (name, reg), template + ALU_OPERAND, src=operand,
+            cycles=7 if reg == 'm' else 4, size=1
+        )
+    # ADI, ACI, SUI, SBI, ANI, XRI, ORI, CPI
+    DISPATCH[0xc6 | i << 3] = specialise(
+        'op_%s_immediate' % name, template + ALU_OPERAND, src='arg1', cycles=7, size=2
+    )
+
+
+RET = '''
+    if (state.f & {mask}) == {value}:
+        state.pc = (state.memory[state.sp + 1] << 8) | state.memory[state.sp]
+        state.sp += 2
+        state.cycles += 11
+    else:
+        state.pc += 1
+        state.cycles += 5
+'''
+
+JMP = '''
+    if (state.f & {mask}) == {value}:
+        state.pc = (arg2 << 8) | arg1
+    else:
+        state.pc += 3
+    state.cycles += 10
+'''
+
+CALL = '''
+    if (state.f & {mask}) == {value}:
+        {push}
+        state.pc = (arg2 << 8) | arg1
+        state.cycles += 17
+    else:
+        state.pc += 3
+        state.cycles += 11
+'''
+
+RST = '''
+    state.int_enable = 0
+    {push}
+    state.pc = {adr}
+    state.cycles += 22
+'''
+
+POP = '''
+    n = (state.memory[state.sp + 1] << 8) | state.memory[state.sp]
+    {write}
+    state.sp += 2
+    state.cycles += 10
+    state.pc += 1
+'''
+
+PUSH = '''
+    {push}
+    state.cycles += 11
+    state.pc += 1
+'''
+
+for i, (cc, mask, value) in enumerate(CONDITIONS):
+    DISPATCH[0xc0 | i << 3] = specialise('op_r' + cc, RET, mask=mask, value=value)
+    DISPATCH[0xc2 | i << 3] = specialise('op_j' + cc, JMP, mask=mask, value=value)
+    DISPATCH[0xc4 | i << 3] = specialise('op_c' + cc, CALL, mask=mask, value=value,
+                                         push=push('state.pc + 3', ' ' * 8))
+    DISPATCH[0xc7 | i << 3] = specialise('op_rst_%d' % i, RST, push=push('state.pc'),
+                                         adr=8 * i)
+
+for i, (pair, read, write) in enumerate(STACK_PAIRS):
+    DISPATCH[0xc1 | i << 4] = specialise('op_pop_' + pair, POP, write=write)
+    DISPATCH[0xc5 | i << 4] = specialise('op_push_' + pair, PUSH, push=push(read))
+
+
+@opcode(0xc3)
+def op_jmp(state, arg1, arg2):
+    # JMP adr
+    state.pc = (arg2 << 8) | arg1
+    state.cycles += 10
+
+
+@opcode(0xc9, 0xd9)
+def op_ret(state, arg1, arg2):
+    # RET, RET*
+    state.pc = (state.memory[state.sp + 1] << 8) | state.memory[state.sp]
+    state.sp += 2
+    state.cycles += 10
+
+
+# CALL adr, CALL* adr
+CALL_ALWAYS = '''
+    {push}
+    state.pc = (arg2 << 8) | arg1
+    state.cycles += 17
+'''
+
+op_call = specialise('op_call', CALL_ALWAYS, push=push('state.pc + 3'))
+for code in (0xcd, 0xdd, 0xed, 0xfd):
+    DISPATCH[code] = op_call
+
+
+@opcode(0xd3)
+def op_out(state, arg1, arg2):
+    # OUT byte
+    state.writers[arg1](state.a)
+    state.cycles += 10
+    state.pc += 2
+
+
+@opcode(0xdb)
+def op_in(state, arg1, arg2):
+    # IN byte
+    state.a = state.readers[arg1]()
+    state.cycles += 10
+    state.pc += 2
+
+
+# OUT and IN to the ports of the shift register, bound to the instructions
+# with these constant ports by State.fuse. Space Invaders draws its sprites
+# with runs of OUT 4 / IN 3.
+
+def op_out_offset(state, arg1, arg2):
+    # OUT 2
+    shifter = state.shifter
+    shifter.offset = (state.a ^ 0xff) & 0x07
+    state.cycles += 10
+    state.pc += 2
+
+
+def op_out_shift(state, arg1, arg2):
+    # OUT 4
+    shifter = state.shifter
+    shifter.register = (shifter.register >> 8) | (state.a << 7)
+    state.cycles += 10
+    state.pc += 2
+
+
+def op_in_shift(state, arg1, arg2):
+    # IN 3
+    shifter = state.shifter
+    state.a = (shifter.register >> shifter.offset) & 0xff
+    state.cycles += 10
+    state.pc += 2
+
+
+# (opcode, port) -> fused handler
+FUSED = {
+    (0xd3, 0x02): op_out_offset,
+    (0xd3, 0x04): op_out_shift,
+    (0xdb, 0x03): op_in_shift,
+}
+
+
+XTHL = '''
+    adr = state.sp
+    x = state.memory[adr]
+    {store_l}
+    state.l = x
+    adr += 1
+    x = state.memory[adr]
+    {store_h}
+    state.h = x
+    state.cycles += 18
+    state.pc += 1
+'''
+
+DISPATCH[0xe3] = specialise('op_xthl', XTHL, store_l=store('adr', 'state.l'),
+                            store_h=store('adr', 'state.h'))
+
+
+@opcode(0xe9)
+def op_pchl(state, arg1, arg2):
+    # PCHL
+    state.pc = (state.h << 8) | state.l
+    state.cycles += 5
+
+
+@opcode(0xeb)
+def op_xchg(state, arg1, arg2):
+    # XCHG
+    state.h, state.l, state.d, state.e = state.d, state.e, state.h, state.l
+    state.cycles += 5
+    state.pc += 1
+
+
+@opcode(0xf3)
+def op_di(state, arg1, arg2):
+    # DI
+    state.int_enable = 0
+    state.cycles += 4
+    state.pc += 1
+
+
+@opcode(0xf9)
+def op_sphl(state, arg1, arg2):
+    # SPHL
+    state.sp = (state.h << 8) | state.l
+    state.pc += 1
 
-        video_ram = self.memory[0x2400:0x4000]
 
-        bits = []
-        bitmap = []
-        for i, byte in enumerate(video_ram):
-            if i != 0 and (i % 32) == 0:
-                bitmap.append(list(reversed(bits)))
-                bits = []
-            bits += list(reversed(bitarray(byte)))
-            if i == len(video_ram) - 1:
-                bitmap.append(list(reversed(bits)))
+@opcode(0xfb)
+def op_ei(state, arg1, arg2):
+    # EI
+    state.int_enable = 1
+    state.cycles += 4
+    state.pc += 1
+
 
-        return np.array(bitmap)
+@opcode(0xcb)
+def op_unimplemented(state, arg1, arg2):
+    raise NotImplementedError("opcode %02x is not implemented" % state.memory[state.pc])
 
 
 def emulate(state, debug=0, opcode=None):
 
+    pc = state.pc
+    if opcode is None and not debug and pc < len(state.decoded):
+        handler, arg1, arg2 = state.decoded[pc]
+        handler(state, arg1, arg2)
+        return
+
     # XXX: You *really* don't wanna reach the end of the memory
+    arg1 = arg2 = None
     if not opcode:
         opcode = state.memory[state.pc]
         arg1 = None if (state.pc + 1) >= len(state.memory) else state.memory[state.pc + 1]
@@ -450,894 +924,64 @@ def emulate(state, debug=0, opcode=None):
                 state.a, state.b, state.c, state.d, state.e, state.h, state.l, state.sp
             ))
 
-    if opcode == 0x00:
-        # NOP
-        state.nop()
-    elif opcode == 0x01:
-        # LXI B, D16
-        state.lxi('bc', arg2, arg1)
-    elif opcode == 0x02:
-        # STAX B
-        state.stax('bc')
-    elif opcode == 0x03:
-        # INX B
-        state.inx('bc')
-    elif opcode == 0x04:
-        # INR B
-        state.inr('b')
-    elif opcode == 0x05:
-        # DCR B
-        state.dcr('b')
-    elif opcode == 0x06:
-        # MVI B, D8
-        state.mvi('b', arg1)
-    elif opcode == 0x07:
-        # RLC
-        h = state.a >> 7
-        state.cc.cy = h
-        state.a = ((state.a << 1) & 0xff) | h
-        state.cycles += 4
-    elif opcode == 0x08:
-        # NOP*
-        state.nop()
-    elif opcode == 0x09:
-        # DAD B
-        state.dad('bc')
-    elif opcode == 0x0a:
-        # LDAX B
-        state.a = state.memory[state.bc]
-        state.cycles += 7
-    elif opcode == 0x0b:
-        # DCX B
-        state.dcx('bc')
-    elif opcode == 0x0c:
-        # INR C
-        state.inr('c')
-    elif opcode == 0x0d:
-        # DCR C
-        state.dcr('c')
-    elif opcode == 0x0e:
-        # MVI C, D8
-        state.mvi('c', arg1)
-    elif opcode == 0x0f:
-        # RRC
-        x = state.a
-        state.a = ((x & 1) << 7) | (x >> 1)
-        state.cc.cy = (x & 1) == 1
-        state.cycles += 4
-    elif opcode == 0x10:
-        # NOP*
-        state.nop()
-    elif opcode == 0x11:
-        # LXI D, D16
-        state.lxi('de', arg2, arg1)
-    elif opcode == 0x12:
-        # STAX D
-        state.stax('de')
-    elif opcode == 0x13:
-        # INX D
-        state.inx('de')
-    elif opcode == 0x14:
-        # INR D
-        state.inr('d')
-    elif opcode == 0x15:
-        # DCR D
-        state.dcr('d')
-    elif opcode == 0x16:
-        # MVI D, D8
-        state.mvi('d', arg1)
-    elif opcode == 0x17:
-        # RAL
-        x = state.a
-        state.a = ((x << 1) & 0xff) | state.cc.cy
-        state.cc.cy = (x & 0x80) != 0
-        state.cycles += 4
-    elif opcode == 0x18:
-        # NOP*
-        state.nop()
-    elif opcode == 0x19:
-        # DAD D
-        state.dad('de')
-    elif opcode == 0x1a:
-        # LDAX D
-        state.a = state.memory[state.de]
-        state.cycles += 7
-    elif opcode == 0x1b:
-        # DCX D
-        state.dcx('de')
-    elif opcode == 0x1c:
-        # INR E
-        state.inr('e')
-    elif opcode == 0x1d:
-        # DCR E
-        state.dcr('e')
-    elif opcode == 0x1e:
-        # MVI E, D8
-        state.mvi('e', arg1)
-    elif opcode == 0x1f:
-        # RAR
-        x = state.a
-        state.a = (state.cc.cy << 7) | (x >> 1)
-        state.cc.cy = (x & 1) == 1
-        state.cycles += 4
-    elif opcode == 0x20:
-        # NOP*
-        state.nop()
-    elif opcode == 0x21:
-        # LXI H, D16
-        state.lxi('hl', arg2, arg1)
-    elif opcode == 0x22:
-        # SHLD, adr
-        adr = merge_bytes(arg2, arg1)
-        state.memory[adr] = state.l
-        state.memory[adr + 1] = state.h
-        state.cycles += 16
-        state.pc += 2
-    elif opcode == 0x23:
-        # INX H
-        state.inx('hl')
-    elif opcode == 0x24:
-        # INR H
-        state.inr('h')
-    elif opcode == 0x25:
-        # DCR H
-        state.dcr('h')
-    elif opcode == 0x26:
-        # MVI H, D8
-        state.mvi('h', arg1)
-    elif opcode == 0x27:
-        # DAA
-        lsb = state.a & 0x0f
-        if lsb > 9 or state.cc.ac:
-            state.a = (state.a + 0x06) & 0xff
-            state.cc.ac = (lsb + 0x06) > 0x0f
-        msb = state.a >> 4
-        if msb > 9 or state.cc.cy:
-            state.a = (state.a + 0x60) & 0xff
-            state.cc.cy = (msb + 0x06) > 0x0f
+    DISPATCH[opcode](state, arg1, arg2)
+
+
+def execute(state, until):
+    """
+    Executes instructions until the cycle count reaches until, the last
+    instruction may overshoot it
+    """
+    memory = state.memory
+    decoded = state.decoded
+    rom = len(decoded)
+    dispatch = DISPATCH
+    end = len(memory) - 2
+    while state.cycles < until:
+        pc = state.pc
+        if pc < rom:
+            handler, arg1, arg2 = decoded[pc]
+            handler(state, arg1, arg2)
+        elif pc < end:
+            dispatch[memory[pc]](state, memory[pc + 1], memory[pc + 2])
         else:
-            state.cc.cy = 0
-        state.cc.p = parity(state.a)
-        state.cc.z = state.a == 0
-        state.cc.s = (state.a & 0x80) != 0
-        state.cycles += 4
-    elif opcode == 0x28:
-        # NOP*
-        state.nop()
-    elif opcode == 0x29:
-        # DAD H
-        state.dad('hl')
-    elif opcode == 0x2a:
-        # LHLD adr
-        adr = merge_bytes(arg2, arg1)
-        state.l = state.memory[adr]
-        state.h = state.memory[adr + 1]
-        state.cycles += 16
-        state.pc += 2
-    elif opcode == 0x2b:
-        # DCX H
-        state.dcx('hl')
-    elif opcode == 0x2c:
-        # INR L
-        state.inr('l')
-    elif opcode == 0x2d:
-        # DCR L
-        state.dcr('l')
-    elif opcode == 0x2e:
-        # MVI L, D8
-        state.mvi('l', arg1)
-    elif opcode == 0x2f:
-        # CMA
-        # python's ~ operator uses signed not, we want unsigned not
-        state.a ^= 0xff
-        state.cycles += 4
-    elif opcode == 0x30:
-        # NOP*
-        state.nop()
-    elif opcode == 0x31:
-        # LXI SP, D16
-        state.lxi('sp', arg2, arg1)
-    elif opcode == 0x32:
-        # STA adr
-        adr = merge_bytes(arg2, arg1)
-        state.memory[adr] = state.a
-        state.pc += 2
-        state.cycles += 13
-    elif opcode == 0x33:
-        # INX SP
-        state.inx('sp')
-    elif opcode == 0x34:
-        # INR M
-        state.inr('m')
-    elif opcode == 0x35:
-        # DCR M
-        state.dcr('m')
-    elif opcode == 0x36:
-        # MVI M, D8
-        state.mvi('m', arg1)
-    elif opcode == 0x37:
-        # STC
-        state.cc.cy = 1
-        state.cycles += 4
-    elif opcode == 0x38:
-        # NOP*
-        state.nop()
-    elif opcode == 0x39:
-        # DAD SP
-        state.dad('sp')
-    elif opcode == 0x3a:
-        # LDA adr
-        adr = merge_bytes(arg2, arg1)
-        state.a = state.memory[adr]
-        state.pc += 2
-        state.cycles += 13
-    elif opcode == 0x3b:
-        # DCX SP
-        state.dcx('sp')
-    elif opcode == 0x3c:
-        # INR A
-        state.inr('a')
-    elif opcode == 0x3d:
-        # DCR A
-        state.dcr('a')
-    elif opcode == 0x3e:
-        # MVI A, D8
-        state.mvi('a', arg1)
-    elif opcode == 0x3f:
-        # CMC
-        state.cc.cy ^= 0x01
-    elif opcode == 0x40:
-        # MOV B, B
-        state.cycles += 5
-    elif opcode == 0x41:
-        # MOV B, C
-        state.b = state.c
-        state.cycles += 5
-    elif opcode == 0x42:
-        # MOV B, D
-        state.b = state.d
-        state.cycles += 5
-    elif opcode == 0x43:
-        # MOV, B, E
-        state.b = state.e
-        state.cycles += 5
-    elif opcode == 0x44:
-        # MOV B, H
-        state.b = state.h
-        state.cycles += 5
-    elif opcode == 0x45:
-        # MOV B, L
-        state.b = state.l
-        state.cycles += 5
-    elif opcode == 0x46:
-        # MOV B, M
-        state.b = state.memory[state.hl]
-        state.cycles += 7
-    elif opcode == 0x47:
-        # MOV B, A
-        state.b = state.a
-        state.cycles += 5
-    elif opcode == 0x48:
-        # MOV C, B
-        state.c = state.b
-        state.cycles += 5
-    elif opcode == 0x49:
-        # MOV C, C
-        state.cycles += 5
-    elif opcode == 0x4a:
-        # MOV C, D
-        state.c = state.d
-        state.cycles += 5
-    elif opcode == 0x4b:
-        # MOV C, E
-        state.c = state.e
-        state.cycles += 5
-    elif opcode == 0x4c:
-        # MOV C, H
-        state.c = state.h
-        state.cycles += 5
-    elif opcode == 0x4d:
-        # MOV C, L
-        state.c = state.l
-        state.cycles += 5
-    elif opcode == 0x4e:
-        # MOV C, M
-        state.c = state.memory[state.hl]
-        state.cycles += 7
-    elif opcode == 0x4f:
-        # MOV C, A
-        state.c = state.a
-        state.cycles += 5
-    elif opcode == 0x50:
-        # MOV D, B
-        state.d = state.b
-        state.cycles += 5
-    elif opcode == 0x51:
-        # MOV D, C
-        state.d = state.c
-        state.cycles += 5
-    elif opcode == 0x52:
-        # MOV D, D
-        state.cycles += 5
-    elif opcode == 0x53:
-        # MOV D, E
-        state.d = state.e
-        state.cycles += 5
-    elif opcode == 0x54:
-        # MOV D, H
-        state.d = state.h
-        state.cycles += 5
-    elif opcode == 0x55:
-        # MOV D, L
-        state.d = state.l
-        state.cycles += 5
-    elif opcode == 0x56:
-        # MOV D, M
-        state.d = state.memory[state.hl]
-        state.cycles += 7
-    elif opcode == 0x57:
-        # MOV D, A
-        state.d = state.a
-        state.cycles += 5
-    elif opcode == 0x58:
-        # MOV E, B
-        state.e = state.b
-        state.cycles += 5
-    elif opcode == 0x59:
-        # MOV E, C
-        state.e = state.c
-        state.cycles += 5
-    elif opcode == 0x5a:
-        # MOV E, D
-        state.e = state.d
-        state.cycles += 5
-    elif opcode == 0x5b:
-        # MOV E, E
-        state.cycles += 5
-    elif opcode == 0x5c:
-        # MOV E, H
-        state.e = state.h
-        state.cycles += 5
-    elif opcode == 0x5d:
-        # MOV E, L
-        state.e = state.l
-        state.cycles += 5
-    elif opcode == 0x5e:
-        # MOV E, M
-        state.e = state.memory[state.hl]
-        state.cycles += 7
-    elif opcode == 0x5f:
-        # MOV E, A
-        state.e = state.a
-        state.cycles += 5
-    elif opcode == 0x60:
-        # MOV H, B
-        state.h = state.b
-        state.cycles += 5
-    elif opcode == 0x61:
-        # MOV H, C
-        state.h = state.c
-        state.cycles += 5
-    elif opcode == 0x62:
-        # MOV H, D
-        state.h = state.d
-        state.cycles += 5
-    elif opcode == 0x63:
-        # MOV H, E
-        state.h = state.e
-        state.cycles += 5
-    elif opcode == 0x64:
-        # MOV H, H
-        state.cycles += 5
-    elif opcode == 0x65:
-        # MOV H, L
-        state.h = state.l
-        state.cycles += 5
-    elif opcode == 0x66:
-        # MOV H, M
-        state.h = state.memory[state.hl]
-        state.cycles += 7
-    elif opcode == 0x67:
-        # MOV H, A
-        state.h = state.a
-        state.cycles += 5
-    elif opcode == 0x68:
-        # MOV L, B
-        state.l = state.b
-        state.cycles += 5
-    elif opcode == 0x69:
-        # MOV L, C
-        state.l = state.c
-        state.cycles += 5
-    elif opcode == 0x6a:
-        # MOV L, D
-        state.l = state.d
-        state.cycles += 5
-    elif opcode == 0x6b:
-        # MOV L, E
-        state.l = state.e
-        state.cycles += 5
-    elif opcode == 0x6c:
-        # MOV L, H
-        state.l = state.h
-        state.cycles += 5
-    elif opcode == 0x6d:
-        # MOV L, L
-        state.cycles += 5
-    elif opcode == 0x6e:
-        # MOV L, M
-        state.l = state.memory[state.hl]
-        state.cycles += 7
-    elif opcode == 0x6f:
-        # MOV L, A
-        state.l = state.a
-        state.cycles += 5
-    elif opcode == 0x70:
-        # MOV M, B
-        state.memory[state.hl] = state.b
-        state.cycles += 7
-    elif opcode == 0x71:
-        # MOV M, C
-        state.memory[state.hl] = state.c
-        state.cycles += 7
-    elif opcode == 0x72:
-        # MOV M, D
-        state.memory[state.hl] = state.d
-        state.cycles += 7
-    elif opcode == 0x73:
-        # MOV M, E
-        state.memory[state.hl] = state.e
-        state.cycles += 7
-    elif opcode == 0x74:
-        # MOV M, H
-        state.memory[state.hl] = state.h
-        state.cycles += 7
-    elif opcode == 0x75:
-        # MOV M, L
-        state.memory[state.hl] = state.l
-        state.cycles += 7
-    elif opcode == 0x76:
-        # HLT
-        state.cycles = 7
-        sys.exit(0)
-    elif opcode == 0x77:
-        # MOV M, A
-        state.memory[state.hl] = state.a
-        state.cycles += 7
-    elif opcode == 0x78:
-        # MOV A, B
-        state.a = state.b
-        state.cycles += 5
-    elif opcode == 0x79:
-        # MOv A, C
-        state.a = state.c
-        state.cycles += 5
-    elif opcode == 0x7a:
-        # MOV A, D
-        state.a = state.d
-        state.cycles += 5
-    elif opcode == 0x7b:
-        # MOV A, E
-        state.a = state.e
-        state.cycles += 5
-    elif opcode == 0x7c:
-        # MOV A, H
-        state.a = state.h
-        state.cycles += 5
-    elif opcode == 0x7d:
-        # MOV A, L
-        state.a = state.l
-        state.cycles += 5
-    elif opcode == 0x7e:
-        # MOV A, M
-        state.a = state.memory[state.hl]
-        state.cycles += 7
-    elif opcode == 0x7f:
-        # MOV A, A
-        state.cycles += 5
-    elif opcode == 0x80:
-        # ADD B
-        state.add('b')
-    elif opcode == 0x81:
-        # ADD C
-        state.add('c')
-    elif opcode == 0x82:
-        # ADD D
-        state.add('d')
-    elif opcode == 0x83:
-        # ADD E
-        state.add('e')
-    elif opcode == 0x84:
-        # ADD H
-        state.add('h')
-    elif opcode == 0x85:
-        # ADD L
-        state.add('l')
-    elif opcode == 0x86:
-        # ADD M
-        state.add('m')
-    elif opcode == 0x87:
-        # ADD A
-        state.add('a')
-    elif opcode == 0x88:
-        # ADC B
-        state.adc('b')
-    elif opcode == 0x89:
-        # ADC C
-        state.adc('c')
-    elif opcode == 0x8a:
-        # ADC D
-        state.adc('d')
-    elif opcode == 0x8b:
-        # ADC E
-        state.adc('e')
-    elif opcode == 0x8c:
-        # ADC H
-        state.adc('h')
-    elif opcode == 0x8d:
-        # ADC L
-        state.adc('l')
-    elif opcode == 0x8e:
-        # ADC M
-        state.adc('m')
-    elif opcode == 0x8f:
-        # ADC A
-        state.adc('a')
-    elif opcode == 0x90:
-        # SUB B
-        state.sub('b')
-    elif opcode == 0x91:
-        # SUB C
-        state.sub('c')
-    elif opcode == 0x92:
-        # SUB D
-        state.sub('d')
-    elif opcode == 0x93:
-        # SUB E
-        state.sub('e')
-    elif opcode == 0x94:
-        # SUB H
-        state.sub('h')
-    elif opcode == 0x95:
-        # SUB L
-        state.sub('l')
-    elif opcode == 0x96:
-        # SUB M
-        state.sub('m')
-    elif opcode == 0x97:
-        # SUB A
-        state.sub('a')
-    elif opcode == 0x98:
-        # SBB B
-        state.sbb('b')
-    elif opcode == 0x99:
-        # SBB C
-        state.sbb('c')
-    elif opcode == 0x9a:
-        # SBB D
-        state.sbb('d')
-    elif opcode == 0x9b:
-        # SBB E
-        state.sbb('e')
-    elif opcode == 0x9c:
-        # SBB H
-        state.sbb('h')
-    elif opcode == 0x9d:
-        # SBB L
-        state.sbb('l')
-    elif opcode == 0x9e:
-        # SBB M
-        state.sbb('m')
-    elif opcode == 0x9f:
-        # SBB A
-        state.sbb('a')
-    elif opcode == 0xa0:
-        # ANA B
-        state.ana('b')
-    elif opcode == 0xa1:
-        # ANA C
-        state.ana('c')
-    elif opcode == 0xa2:
-        # ANA D
-        state.ana('d')
-    elif opcode == 0xa3:
-        # ANA E
-        state.ana('e')
-    elif opcode == 0xa4:
-        # ANA H
-        state.ana('h')
-    elif opcode == 0xa5:
-        # ANA L
-        state.ana('l')
-    elif opcode == 0xa6:
-        # ANA M
-        state.ana('m')
-    elif opcode == 0xa7:
-        # ANA A
-        state.ana('a')
-    elif opcode == 0xa8:
-        # XRA B
-        state.xra('b')
-    elif opcode == 0xa9:
-        # XRA C
-        state.xra('c')
-    elif opcode == 0xaa:
-        # XRA D
-        state.xra('d')
-    elif opcode == 0xab:
-        # XRA E
-        state.xra('e')
-    elif opcode == 0xac:
-        # XRA H
-        state.xra('h')
-    elif opcode == 0xad:
-        # XRA L
-        state.xra('l')
-    elif opcode == 0xae:
-        # XRA M
-        state.xra('m')
-    elif opcode == 0xaf:
-        # XRA A
-        state.xra('a')
-    elif opcode == 0xb0:
-        # ORA B
-        state.ora('b')
-    elif opcode == 0xb1:
-        # ORA C
-        state.ora('c')
-    elif opcode == 0xb2:
-        # ORA D
-        state.ora('d')
-    elif opcode == 0xb3:
-        # ORA E
-        state.ora('e')
-    elif opcode == 0xb4:
-        # ORA H
-        state.ora('h')
-    elif opcode == 0xb5:
-        # ORA L
-        state.ora('l')
-    elif opcode == 0xb6:
-        # ORA M
-        state.ora('m')
-    elif opcode == 0xb7:
-        # ORA A
-        state.ora('a')
-    elif opcode == 0xb8:
-        # CMP B
-        state.cmp('b')
-    elif opcode == 0xb9:
-        # CMP C
-        state.cmp('c')
-    elif opcode == 0xba:
-        # CMP D
-        state.cmp('d')
-    elif opcode == 0xbb:
-        # CMP E
-        state.cmp('e')
-    elif opcode == 0xbc:
-        # CMP H
-        state.cmp('h')
-    elif opcode == 0xbd:
-        # CMP L
-        state.cmp('l')
-    elif opcode == 0xbe:
-        # CMP M
-        state.cmp('m')
-    elif opcode == 0xbf:
-        # CMP A
-        state.cmp('a')
-    elif opcode == 0xc0:
-        # RNZ
-        return state.ret('z', True)
-    elif opcode == 0xc1:
-        # POP B
-        state.pop('bc')
-    elif opcode == 0xc2:
-        # JNZ adr
-        return state.jmp(merge_bytes(arg2, arg1), 'z', True)
-    elif opcode == 0xc3:
-        # JMP adr
-        return state.jmp(merge_bytes(arg2, arg1))
-    elif opcode == 0xc4:
-        # CNZ adr
-        return state.call(merge_bytes(arg2, arg1), 'z', True)
-    elif opcode == 0xc5:
-        # PUSH B
-        state.push('bc')
-    elif opcode == 0xc6:
-        # ADI byte
-        state.add(arg1)
-        state.pc += 1
-    elif opcode == 0xc7:
-        # RST 0
-        return state.rst(0)
-    elif opcode == 0xc8:
-        # RZ
-        return state.ret('z')
-    elif opcode == 0xc9:
-        # RET
-        return state.ret()
-    elif opcode == 0xca:
-        # JZ adr
-        return state.jmp(merge_bytes(arg2, arg1), 'z')
-    elif opcode == 0xcc:
-        # CZ adr
-        return state.call(merge_bytes(arg2, arg1), 'z')
-    elif opcode == 0xcd:
-        # CALL adr
-        return state.call(merge_bytes(arg2, arg1))
-    elif opcode == 0xce:
-        # ACI D8
-        state.adc(arg1)
-        state.pc += 1
-    elif opcode == 0xcf:
-        # RST 1
-        return state.rst(1)
-    elif opcode == 0xd0:
-        # RNC
-        return state.ret('cy', True)
-    elif opcode == 0xd1:
-        # POP D
-        state.pop('de')
-    elif opcode == 0xd2:
-        # JNC adr
-        return state.jmp(merge_bytes(arg2, arg1), 'cy', True)
-    elif opcode == 0xd3:
-        # OUT byte
-        bus.write(arg1, state.a)
-        state.pc += 1
-        state.cycles += 10
-    elif opcode == 0xd4:
-        # CNC adr
-        return state.call(merge_bytes(arg2, arg1), 'cy', True)
-    elif opcode == 0xd5:
-        # PUSH D
-        state.push('de')
-    elif opcode == 0xd6:
-        # SUI D8
-        state.sub(arg1)
-        state.pc += 1
-    elif opcode == 0xd7:
-        # RST 2
-        return state.rst(2)
-    elif opcode == 0xd8:
-        # RC
-        return state.ret('cy')
-    elif opcode == 0xd9:
-        # RET*
-        return state.ret()
-    elif opcode == 0xda:
-        # JC adr
-        return state.jmp(merge_bytes(arg2, arg1), 'cy')
-    elif opcode == 0xdb:
-        # IN D8
-        state.a = bus.read(arg1)
-        state.pc += 1
-        state.cycles += 10
-    elif opcode == 0xdc:
-        # CC adr
-        return state.call(merge_bytes(arg2, arg1), 'cy')
-    elif opcode == 0xdd:
-        # CALL* adr
-        return state.call(merge_bytes(arg2, arg1))
-    elif opcode == 0xde:
-        # SBI D8
-        state.sbb(arg1)
-        state.pc += 1
-    elif opcode == 0xdf:
-        # RST 3
-        return state.rst(3)
-    elif opcode == 0xe0:
-        # RPO
-        return state.ret('p', True)
-    elif opcode == 0xe1:
-        # POP H
-        state.pop('hl')
-    elif opcode == 0xe2:
-        # JPO adr
-        return state.jmp(merge_bytes(arg2, arg1), 'p', True)
-    elif opcode == 0xe3:
-        # XTHL
-        state.l, state.memory[state.sp] = state.memory[state.sp], state.l
-        state.h, state.memory[state.sp + 1] = state.memory[state.sp + 1], state.h
-        state.cycles += 18
-    elif opcode == 0xe4:
-        # CPO adr
-        return state.call(merge_bytes(arg2, arg1), 'p', True)
-    elif opcode == 0xe5:
-        # PUSH H
-        state.push('hl')
-    elif opcode == 0xe6:
-        # ANI byte
-        state.ana(arg1)
-        state.pc += 1
-    elif opcode == 0xe7:
-        return state.rst(4)
-    elif opcode == 0xe8:
-        # RPE
-        return state.ret('p')
-    elif opcode == 0xe9:
-        # PCHL
-        state.pc = state.hl
-        state.cycles += 5
-        return
-    elif opcode == 0xea:
-        # JPE adr
-        return state.jmp(merge_bytes(arg2, arg1), 'p')
-    elif opcode == 0xeb:
-        # XCHG
-        state.hl, state.de = state.de, state.hl
-        state.cycles += 5
-    elif opcode == 0xec:
-        # CPE adr
-        return state.call(merge_bytes(arg2, arg1), 'p')
-    elif opcode == 0xed:
-        # CALL* adr
-        return state.call(merge_bytes(arg2, arg1))
-    elif opcode == 0xee:
-        # XRI D8
-        state.xra(arg1)
-        state.pc += 1
-    elif opcode == 0xef:
-        # RST 5
-        return state.rst(5)
-    elif opcode == 0xf0:
-        # RP
-        return state.ret('s', True)
-    elif opcode == 0xf1:
-        # POP PSW
-        state.pop('psw')
-    elif opcode == 0xf2:
-        # JP adr
-        return state.jmp(merge_bytes(arg2, arg1), 's', True)
-    elif opcode == 0xf3:
-        # DI
-        state.int_enable = 0
-        state.cycles += 4
-    elif opcode == 0xf4:
-        # CP adr
-        return state.call(merge_bytes(arg2, arg1), 's', True)
-    elif opcode == 0xf5:
-        # PUSH PSW
-        state.push('psw')
-    elif opcode == 0xf6:
-        # ORI D8
-        state.ora(arg1)
-        state.pc += 1
-    elif opcode == 0xf7:
-        # RST 6
-        return state.rst(6)
-    elif opcode == 0xf8:
-        # RM
-        return state.ret('s')
-    elif opcode == 0xf9:
-        # SPHL
-        state.sp = state.hl
-    elif opcode == 0xfa:
-        # JM adr
-        return state.jmp(merge_bytes(arg2, arg1), 's')
-    elif opcode == 0xfb:
-        # EI
-        state.int_enable = 1
-        state.cycles += 4
-    elif opcode == 0xfc:
-        # CM adr
-        return state.call(merge_bytes(arg2, arg1), 's')
-    elif opcode == 0xfd:
-        # CALL* adr
-        return state.call(merge_bytes(arg2, arg1))
-    elif opcode == 0xfe:
-        # CPI, D8
-        state.cmp(arg1)
-        state.pc += 1
-    elif opcode == 0xff:
-        # RST 7
-        return state.rst(7)
-    else:
-        raise NotImplementedError("opcode %02x is not implemented" % opcode)
+            emulate(state)
 
-    state.pc += 1
+
+class Interpreter:
+    """
+    Executes instructions one at a time, with debug output when debug is set
+
+    Engines execute the instructions of a machine.Machine: run executes
+    them up to a cycle count, step a single one, run_block a run of them
+    that ends at any EI and interrupt the RST of an interrupt. Translator
+    and Profiler are the other engines.
+    """
+
+    def __init__(self, debug=0):
+        self.debug = debug
+        self.count = 0
+
+    def run(self, state, until):
+        if not self.debug:
+            execute(state, until)
+            return
+        while state.cycles < until:
+            self.step(state)
+
+    def step(self, state):
+        emulate(state, self.debug)
+        self.count += 1
+        if self.debug >= 3:
+            print("Instruction count: %d" % self.count)
+        if self.debug >= 4:
+            print("Current cycles: %d" % state.cycles)
+
+    # single instructions end at EI like the blocks of Translator
+    run_block = step
+
+    def interrupt(self, state, opcode):
+        emulate(state, self.debug, opcode)
 
 
 def parse():
@@ -1349,41 +993,126 @@ def parse():
     parser.add_argument('bin', nargs=1, help="Program to execute")
     parser.add_argument('-H', '--headless', action='store_true', default=False,
                         help="Launch game without rendering it, for debugging purposes")
+    parser.add_argument('-r', '--render-process', action='store_true', default=False,
+                        help="Rasterize and present the frames in a separate process")
+    parser.add_argument('-t', '--turbo', action='store_true', default=False,
+                        help="Run as fast as possible instead of at 60 frames per second")
+    parser.add_argument('-i', '--interpret', action='store_true', default=False,
+                        help="Interpret every instruction instead of translating blocks of code")
+    parser.add_argument('-R', '--rewind', type=int, default=0, metavar='SECONDS',
+                        help="Keep the last frames to rewind through while R is held")
+    parser.add_argument('--record', default=None, metavar='FILE',
+                        help="Log the controller ports of every frame to a file")
+    parser.add_argument('--replay', default=None, metavar='FILE',
+                        help="Feed the controller ports logged by --record back, headless at full speed")
+    parser.add_argument('-f', '--frames', type=int, default=0,
+                        help="Stop after a number of frames and print the sha1 of the memory")
+    parser.add_argument('-p', '--profile', default=None,
+                        help="Interpret and profile every instruction, write a report to a file on exit")
+    parser.add_argument('-F', '--flamegraph', default=None,
+                        help="Interpret and profile every instruction, write the cycles per "
+                             "call stack to a file on exit, in the format of flamegraph.pl")
     return parser.parse_args()
 
 
 def main():
+    from machine import Machine
+
     args = parse()
 
     with open(args.bin[0], 'rb') as f:
-        state = State(f.read())
+        machine = Machine(f.read())
+    state = machine.state
+
+    inputs = None
+    if args.record:
+        from replay import InputRecorder
+        inputs = InputRecorder(args.record, machine)
+    elif args.replay:
+        from replay import InputReplay
+        inputs = InputReplay(args.replay, machine)
+        args.headless = args.turbo = True
+
+    renderer = screen = None
+    if args.render_process and not args.headless:
+        from renderer import RenderProcess
+        renderer = RenderProcess()
+    elif not args.headless:
+        import pygame
+        from screen import Screen
+        pygame.display.init()
+        screen = Screen()
+
+    profiler = None
+    if args.profile or args.flamegraph:
+        from profiler import Profiler
+        machine.engine = profiler = Profiler(state)
+    elif args.interpret or args.debug:
+        machine.engine = Interpreter(args.debug)
+
+    try:
+        run(machine, args, screen, renderer, Pacer(args.turbo), inputs)
+    finally:
+        if renderer is not None:
+            renderer.close()
+        if inputs is not None:
+            inputs.close()
+        if args.profile:
+            with open(args.profile, 'w') as f:
+                profiler.report(f)
+        if args.flamegraph:
+            with open(args.flamegraph, 'w') as f:
+                profiler.collapsed(f)
+
+
+def run(machine, args, screen, renderer, pacer, inputs=None):
+    state = machine.state
+    bus = machine.bus
+
+    video_ram = state.video_ram()
+    if not args.headless:
+        import pygame
+
+    rewind = None
+    if args.rewind:
+        from rewind import Rewind
+        rewind = Rewind(machine, args.rewind)
+
+    def frame():
+        if renderer is not None:
+            renderer.present(state)
+            for event in renderer.poll_events():
+                bus.handle_event(*event)
+        elif not args.headless:
+            bus.handle_events()
+            screen.present(video_ram, state.dirty)
+        frames = machine.display.frames
+        if inputs is not None:
+            inputs.latch(frames)
+        else:
+            bus.latch_input()
+        if args.frames and frames >= args.frames:
+            print("Memory sha1 after %d frames: %s" % (frames, hashlib.sha1(state.memory).hexdigest()))
+            sys.exit(0)
+        if rewind is not None:
+            if not args.headless and pygame.K_r in bus.held:
+                rewind.request()
+            else:
+                rewind.record()
 
-    pygame.display.init()
-    pygame.time.Clock().tick(60)
-    screen = pygame.display.set_mode((224, 256))
+        if pacer.frame(state.cycles):
+            if renderer is not None:
+                renderer.set_caption(pacer.title())
+            elif not args.headless:
+                pygame.display.set_caption("%s, %.0f us/frame presented" % (pacer.title(), screen.cost()))
+            else:
+                print(pacer.title())
 
-    count = 1
+    machine.display.frame_hooks.append(frame)
     while 1:
-        bus.handle_events()
-        if state.int_enable:
-            if bus.loop(state.cycles):
-                # Screen refresh
-                if not args.headless:
-                    screen.convert()
-                    pygame.surfarray.blit_array(screen, state.rasterize())
-                    pygame.display.flip()
-                state.cycles = 0
-                emulate(state, args.debug, bus.interrupts.popleft())
-                continue
-
-        emulate(state, args.debug)
-
-        if args.debug >= 3:
-            print("Instruction count: %d" % count)
-            count += 1
-
-        if args.debug >= 4:
-            print("Current cycles: %d" % state.cycles)
+        machine.run()
+        if rewind is not None:
+            rewind.apply()
 
 
 if __name__ == '__main__':
@@ -1,17 +1,30 @@
 class ShiftRegister:
+    """
+    Hardware shift register on ports 2, 3 and 4, the fused OUT and IN
+    handlers of cpu.FUSED work on its attributes directly
+    """
+
+    __slots__ = ('register', 'offset')
 
     def __init__(self):
-        self._register = 0x0000
-        self._offset = 0x0
+        self.register = 0x0000
+        self.offset = 0x0
 
     def get_register(self):
-        return (self._register >> self._offset) & 0xff
+        return (self.register >> self.offset) & 0xff
 
     def shift(self, val):
-        self._register = (self._register >> 8) | (val << 7)
+        self.register = (self.register >> 8) | (val << 7)
 
     def set_offset(self, val):
-        self._offset = (val ^ 0xff) & 0x07
+        self.offset = (val ^ 0xff) & 0x07
+
+    def snapshot(self):
+        return self.register, self.offset
+
+    def restore(self, register, offset):
+        self.register = register
+        self.offset = offset
 
 
 class Controller:
@@ -24,12 +37,25 @@ class Controller:
         self._p1_reg = 0x08
         self._p2_reg = 0x00
 
+    def latch(self, buttons):
+        """ Sets the ports from the names of the buttons held down """
+        self.reset()
+        for button in buttons:
+            getattr(self, button)()
+
     def get_p1(self):
         return self._p1_reg
 
     def get_p2(self):
         return self._p2_reg
 
+    def snapshot(self):
+        return self._p1_reg, self._p2_reg
+
+    def restore(self, p1, p2):
+        self._p1_reg = p1
+        self._p2_reg = p2
+
     def start_p1(self):
         self._p1_reg |= 0x04
 
@@ -59,17 +85,59 @@ class Controller:
 
 
 class Display:
+    """
+    Video timing, the hardware requests RST 1 when the beam is halfway
+    through the screen and RST 2 when it reaches the end of it (vblank)
+    """
 
     def __init__(self):
-        self.max_cycles = 2000000/60
-
-    def refresh(self, cycles):
-        if cycles >= self.max_cycles:
-            return 0xcf, 0xd7
-
+        self.cycles_per_frame = 2000000 // 60
+        self.frames = 0
+        # called at every vblank, after requesting its interrupt
+        self.frame_hooks = []
+        # cycles of the next half frame and end of frame interrupts
+        self.next_half = self.next_end = None
+
+    def start(self, scheduler, interrupt, cycle=0):
+        """
+        Schedules the display interrupts of the frame starting at cycle
+
+        Arguments:
+            scheduler (Scheduler): scheduler of the timed events
+            interrupt (callable): requests an interrupt, takes its opcode
+            cycle (int): cycle count at which the frame starts
+        """
+        self.scheduler = scheduler
+        self.interrupt = interrupt
+        self.schedule(cycle + self.cycles_per_frame // 2, cycle + self.cycles_per_frame)
+
+    def schedule(self, half, end):
+        """ Schedules the next half frame and end of frame interrupts at these cycles """
+        self.next_half = half
+        self.next_end = end
+        self.scheduler.schedule(half, self.half_frame)
+        self.scheduler.schedule(end, self.end_frame)
+
+    def half_frame(self, cycle):
+        self.interrupt(0xcf)
+        self.next_half = cycle + self.cycles_per_frame
+        self.scheduler.schedule(self.next_half, self.half_frame)
+
+    def end_frame(self, cycle):
+        self.interrupt(0xd7)
+        self.frames += 1
+        # scheduled before the hooks run so that they see the display as it
+        # stands for the next frame, e.g. when saving it
+        self.next_end = cycle + self.cycles_per_frame
+        self.scheduler.schedule(self.next_end, self.end_frame)
+        for hook in self.frame_hooks:
+            hook()
+
+    def snapshot(self):
+        return self.next_half, self.next_end, self.frames
+
+    def restore(self, half, end, frames):
+        """ Replaces the scheduled interrupts, the scheduler must have been cleared """
+        self.frames = frames
+        self.schedule(half, end)
 
-devices = {
-    'shft_reg': ShiftRegister(),
-    'ctrl': Controller(),
-    'dspl': Display(),
-}
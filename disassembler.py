@@ -1,3 +1,5 @@
+import re
+
 OPCODES = {
     # OPCODE: [INSTRUCTION, SIZE]
     0x00: ['NOP', 1],
@@ -215,7 +217,7 @@ OPCODES = {
     0xD4: ['CNC %02x%02x', 3],
     0xD5: ['PUSH D', 1],
     0xD6: ['SUI %02x', 2],
-    0xD7: ['RST 2'],
+    0xD7: ['RST 2', 1],
     0xD8: ['RC', 1],
     0xD9: ['RET*', 1],
     0xDA: ['JC %02x%02x', 3],
@@ -259,15 +261,24 @@ OPCODES = {
 }
 
 
-def disassemble(codebuffer, pc):
+def instruction(codebuffer, pc):
+    """ Returns the assembly of the instruction at pc """
     asm, opbytes = OPCODES[codebuffer[pc]]
     if opbytes == 3:
-        print("%04x " % pc + asm % (codebuffer[pc + 2], codebuffer[pc + 1]))
+        return asm % (codebuffer[pc + 2], codebuffer[pc + 1])
     elif opbytes == 2:
-        print("%04x " % pc + asm % (codebuffer[pc + 1]))
-    else:
-        print("%04x " % pc + asm)
-    return opbytes
+        return asm % (codebuffer[pc + 1])
+    return asm
+
+
+def mnemonic(opcode):
+    """ Returns the mnemonic of an opcode without its operands, e.g. MVI B """
+    return re.sub(r',?\s*%02x', '', OPCODES[opcode][0])
+
+
+def disassemble(codebuffer, pc):
+    print("%04x " % pc + instruction(codebuffer, pc))
+    return OPCODES[codebuffer[pc]][1]
 
 
 def main():
@@ -0,0 +1,61 @@
+from bus import Bus
+from cpu import MEMORY_MAP, State
+from devices import Controller, Display, ShiftRegister
+from translator import Translator
+
+
+class Machine:
+    """
+    A Space Invaders machine: the CPU state, its bus and the devices on it
+
+    Machines share nothing, so any number of them can run side by side.
+    The instructions are executed by an engine, the translator unless
+    engine is replaced, e.g. with a cpu.Interpreter.
+
+    Arguments:
+        rom (bytes): contents of the start of the memory
+        regions (list): region descriptors of the memory map
+        fuse (bool): whether the instructions using the ports of the shift
+            register work on it directly, see cpu.State.fuse
+    """
+
+    def __init__(self, rom, regions=MEMORY_MAP, fuse=True):
+        self.state = State(rom, regions)
+        self.shift_register = ShiftRegister()
+        self.controller = Controller()
+        self.display = Display()
+        self.bus = Bus(self.shift_register, self.controller, self.display)
+        # the opcode handlers reach the ports through the state
+        self.state.readers = self.bus.readers
+        self.state.writers = self.bus.writers
+        if fuse:
+            self.state.fuse(self.shift_register)
+        self.engine = Translator(self.state)
+        self.stopped = False
+
+    def run(self, cycles=float('inf')):
+        """
+        Executes instructions and fires the timed events until the cycle
+        count reaches cycles or stop is called, e.g. from a frame hook
+        """
+        state = self.state
+        engine = self.engine
+        interrupts = self.bus.interrupts
+        scheduler = self.bus.scheduler
+        self.stopped = False
+        while state.cycles < cycles and not self.stopped:
+            if state.int_enable and interrupts:
+                engine.interrupt(state, interrupts.popleft())
+
+            if interrupts:
+                # blocks end at EI, so a pending interrupt is still taken
+                # as soon as they're enabled
+                engine.run_block(state)
+            else:
+                engine.run(state, min(scheduler.next_cycle(), cycles))
+
+            scheduler.run(state.cycles)
+
+    def stop(self):
+        """ Makes run return once the current events are fired """
+        self.stopped = True
@@ -0,0 +1,61 @@
+# flags of the pages of the address space, the stores to a page without
+# flags go straight to memory
+PAGE_ROM = 0x01  # writes are ignored
+PAGE_VIDEO = 0x02  # writes mark the video RAM row dirty
+PAGE_MIRROR = 0x04  # writes go to the mirrored page
+PAGE_CODE = 0x08  # holds translated code, writes invalidate it
+PAGE_MIRRORED = 0x10  # repeated by mirrors, writes update their copies
+
+
+class MemoryMap:
+    """
+    Page table of the address space built from region descriptors
+
+    Every region is a (name, start, end, flags, mirrored) tuple, where start
+    and end are multiples of the 256-byte page size and mirrored is the
+    (start, end) range repeated over a PAGE_MIRROR region, or None. Pages
+    not covered by any region are plain RAM.
+
+    The reads of a mirror aren't redirected, the pages it repeats are
+    flagged with PAGE_MIRRORED instead and their stores update the mirror's
+    copies of the byte, so that both addresses read back what was written.
+    """
+
+    def __init__(self, regions, size=0x10000):
+        self.regions = regions
+        self.pages = bytearray((size + 0xff) >> 8)
+        # page actually written for every page, differs for mirrors only
+        self.targets = list(range(len(self.pages)))
+        # (offset, end, step, fill) of the copies of every PAGE_MIRRORED
+        # page, the copies of adr are memory[adr + offset:end:step] and
+        # fill[value] repeats value for each of them
+        self.mirrors = [[] for _ in self.pages]
+        for name, start, end, flags, mirrored in regions:
+            for page in range(start >> 8, end >> 8):
+                self.pages[page] = flags
+                if mirrored:
+                    first, last = mirrored[0] >> 8, mirrored[1] >> 8
+                    target = first + (page - (start >> 8)) % (last - first)
+                    self.targets[page] = target
+                    self.mirrors[target].append(page)
+
+        fills = {}
+        for page, copies in enumerate(self.mirrors):
+            if not copies:
+                self.mirrors[page] = None
+                continue
+            step = copies[1] - copies[0] if len(copies) > 1 else 1
+            if any(b - a != step for a, b in zip(copies, copies[1:])):
+                raise ValueError("mirrors of page %02x aren't evenly spaced" % page)
+            if len(copies) not in fills:
+                fills[len(copies)] = [bytes((value,)) * len(copies) for value in range(0x100)]
+            self.pages[page] |= PAGE_MIRRORED
+            self.mirrors[page] = ((copies[0] - page) << 8, (copies[-1] + 1) << 8, step << 8,
+                                  fills[len(copies)])
+
+    def rom_size(self):
+        """ Returns the size of the ROM at the start of the address space """
+        page = 0
+        while page < len(self.pages) and self.pages[page] & PAGE_ROM:
+            page += 1
+        return page << 8
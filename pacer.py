@@ -0,0 +1,64 @@
+import time
+
+from collections import namedtuple
+
+Status = namedtuple('Status', 'mhz fps speed')
+
+
+class Pacer:
+    """
+    Keeps the emulation at the speed of the real hardware and measures how
+    fast it actually runs
+
+    The pacer is called at every frame boundary, it sleeps off whatever is
+    left of the frame's time budget unless turbo is set. If the emulation
+    falls behind it doesn't try to catch up, it just starts pacing again
+    from the current frame.
+    """
+
+    def __init__(self, turbo=False, clock=2000000, fps=60, interval=1.0):
+        self.turbo = turbo
+        self.clock = clock
+        self.frame_time = 1 / fps
+        self.interval = interval
+        self.deadline = None
+        self.status = Status(0.0, 0.0, 0.0)
+        self._start = None
+        self._cycles = 0
+        self._frames = 0
+
+    def frame(self, cycles):
+        """
+        Ends a frame, returns True when the status was updated
+
+        Arguments:
+            cycles (int): absolute cycle count at the end of the frame
+        """
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = self.deadline = now
+            self._cycles = cycles
+            return False
+
+        if not self.turbo:
+            self.deadline += self.frame_time
+            if self.deadline > now:
+                time.sleep(self.deadline - now)
+            else:
+                self.deadline = now
+
+        self._frames += 1
+        now = time.perf_counter()
+        elapsed = now - self._start
+        if elapsed < self.interval:
+            return False
+
+        hz = (cycles - self._cycles) / elapsed
+        self.status = Status(hz / 1e6, self._frames / elapsed, hz / self.clock * 100)
+        self._start = now
+        self._cycles = cycles
+        self._frames = 0
+        return True
+
+    def title(self):
+        return "%.2f MHz, %.1f fps, %.0f%% speed" % self.status
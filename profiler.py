@@ -0,0 +1,148 @@
+import cpu
+
+from disassembler import instruction, mnemonic
+
+# what the opcodes do to the call stack when they're taken: CALL, the
+# conditional calls and RST push a return address, RET and the conditional
+# returns pop it
+CALL = 1
+RETURN = 2
+KINDS = bytearray(0x100)
+for code in (0xcd, 0xdd, 0xed, 0xfd):
+    KINDS[code] = CALL
+for i in range(8):
+    KINDS[0xc4 | i << 3] = KINDS[0xc7 | i << 3] = CALL
+    KINDS[0xc0 | i << 3] = RETURN
+KINDS[0xc9] = KINDS[0xd9] = RETURN
+
+
+class Profiler:
+    """
+    Interprets instructions while counting where the cycles go
+
+    Opcodes and addresses are counted in arrays allocated up front. Calls
+    are tracked as a tree of the call stacks seen so far, every node is the
+    entry point of a subroutine under its caller's node, so that the
+    cycles can be attributed to stacks without building them on the fly.
+    Like Translator, a profiler is bound to a state and can be the engine of
+    a machine.Machine.
+    """
+
+    def __init__(self, state):
+        self.memory = state.memory
+        self.opcode_counts = [0] * 0x100
+        self.opcode_cycles = [0] * 0x100
+        self.pc_counts = [0] * len(state.memory)
+        self.pc_cycles = [0] * len(state.memory)
+        # node 0 is the code running when profiling starts
+        self.node = 0
+        self.entries = [None]
+        self.parents = [0]
+        self.calls = [0]
+        self.node_cycles = [0]
+        # (node, entry point) -> node of the call
+        self.children = {}
+
+    def run(self, state, until):
+        """
+        Executes instructions until the cycle count reaches until, the last
+        instruction may overshoot it
+        """
+        while state.cycles < until:
+            self.step(state)
+
+    def step(self, state):
+        """ Executes the instruction at the current pc """
+        pc = state.pc
+        memory = state.memory
+        opcode = memory[pc]
+        cycles = state.cycles
+        sp = state.sp
+        cpu.DISPATCH[opcode](state, memory[pc + 1], memory[pc + 2])
+        cycles = state.cycles - cycles
+        self.opcode_counts[opcode] += 1
+        self.opcode_cycles[opcode] += cycles
+        self.pc_counts[pc] += 1
+        self.pc_cycles[pc] += cycles
+        self.node_cycles[self.node] += cycles
+        if KINDS[opcode] and state.sp != sp:
+            self.follow(KINDS[opcode], state.pc)
+
+    # single instructions end at EI like the blocks of Translator
+    run_block = step
+
+    def interrupt(self, state, opcode):
+        """ Executes an interrupt's RST, counted as a call from the current pc """
+        cycles = state.cycles
+        cpu.DISPATCH[opcode](state, None, None)
+        self.opcode_counts[opcode] += 1
+        self.opcode_cycles[opcode] += state.cycles - cycles
+        self.follow(CALL, state.pc)
+
+    def follow(self, kind, target):
+        """ Moves to the node of the call stack left by a taken call or return """
+        node = self.node
+        if kind == RETURN:
+            # returns without a call, e.g. a jump through the stack, stay at the root
+            self.node = self.parents[node]
+            return
+        child = self.children.get((node, target))
+        if child is None:
+            child = self.children[node, target] = len(self.entries)
+            self.entries.append(target)
+            self.parents.append(node)
+            self.calls.append(0)
+            self.node_cycles.append(0)
+        self.calls[child] += 1
+        self.node = child
+
+    def stack(self, node):
+        """ Returns the entry points of the subroutines on the stack of a node """
+        entries = []
+        while node:
+            entries.append(self.entries[node])
+            node = self.parents[node]
+        return entries[::-1]
+
+    def edges(self):
+        """ Returns a {(caller, callee): calls} dict, the caller is None for the root """
+        edges = {}
+        for node in range(1, len(self.entries)):
+            edge = (self.entries[self.parents[node]], self.entries[node])
+            edges[edge] = edges.get(edge, 0) + self.calls[node]
+        return edges
+
+    def report(self, f, top=20):
+        """ Writes the opcodes, addresses and calls that took the most cycles """
+        total = sum(self.opcode_cycles) or 1
+        f.write("opcodes by cycles\n")
+        opcodes = sorted(range(0x100), key=lambda opcode: -self.opcode_cycles[opcode])
+        for opcode in opcodes[:top]:
+            if self.opcode_counts[opcode]:
+                f.write("  %02x %-8s %10d %12d %5.1f%%\n" % (
+                    opcode, mnemonic(opcode), self.opcode_counts[opcode],
+                    self.opcode_cycles[opcode], self.opcode_cycles[opcode] / total * 100
+                ))
+
+        f.write("addresses by cycles\n")
+        pcs = sorted(range(len(self.pc_cycles)), key=lambda pc: -self.pc_cycles[pc])
+        for pc in pcs[:top]:
+            if self.pc_counts[pc]:
+                f.write("  %04x %-16s %10d %12d %5.1f%%\n" % (
+                    pc, instruction(self.memory, pc), self.pc_counts[pc],
+                    self.pc_cycles[pc], self.pc_cycles[pc] / total * 100
+                ))
+
+        f.write("calls\n")
+        edges = sorted(self.edges().items(), key=lambda item: -item[1])
+        for (caller, callee), calls in edges[:top]:
+            f.write("  %4s -> %04x %10d\n" % (
+                'root' if caller is None else '%04x' % caller, callee, calls
+            ))
+
+    def collapsed(self, f):
+        """ Writes the cycles of every call stack in the collapsed format of flamegraph.pl """
+        for node, cycles in enumerate(self.node_cycles):
+            if cycles:
+                names = ['root'] + ['%04x' % entry for entry in self.stack(node)]
+                f.write("%s %d\n" % (';'.join(names), cycles))
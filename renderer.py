@@ -0,0 +1,112 @@
+import multiprocessing
+import numpy as np
+import pygame
+
+from multiprocessing import shared_memory
+from cpu import SCREEN_WIDTH, VIDEO_RAM, VIDEO_RAM_END, VIDEO_RAM_SIZE
+from screen import Screen
+
+# Layout of the shared block: a snapshot of the video RAM followed by the
+# dirty row flags accumulated since the previous snapshot
+SHARED_SIZE = VIDEO_RAM_SIZE + SCREEN_WIDTH
+
+
+class RenderProcess:
+    """
+    Rasterizes and presents frames in a separate process
+
+    At every frame boundary the CPU process copies the video RAM into a
+    shared memory block and signals the renderer, if the renderer is still
+    busy with the previous frame the new one is dropped and its dirty rows
+    are carried over to the next one. The renderer owns the window, so it
+    also forwards the input events back to the CPU process.
+    """
+
+    def __init__(self):
+        self.shm = shared_memory.SharedMemory(create=True, size=SHARED_SIZE)
+        self.video_ram = self.shm.buf[:VIDEO_RAM_SIZE]
+        self.dirty = self.shm.buf[VIDEO_RAM_SIZE:SHARED_SIZE]
+        self.idle = multiprocessing.Event()
+        self.pending = multiprocessing.Event()
+        self.stopped = multiprocessing.Event()
+        self.events, events = multiprocessing.Pipe(duplex=False)
+        captions, self.captions = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(
+            target=render,
+            args=(self.shm.name, self.idle, self.pending, self.stopped, events, captions),
+            daemon=True
+        )
+        self.process.start()
+        self.frames = 0
+        self.dropped = 0
+
+    def present(self, state):
+        """ Hands the current video RAM over to the renderer """
+        if not self.idle.is_set():
+            self.dropped += 1
+            return False
+        self.idle.clear()
+        self.video_ram[:] = state.memory[VIDEO_RAM:VIDEO_RAM_END]
+        self.dirty[:] = state.dirty
+        state.dirty[:] = bytes(SCREEN_WIDTH)
+        self.pending.set()
+        self.frames += 1
+        return True
+
+    def poll_events(self):
+        """ Returns the (type, key) input events forwarded by the renderer """
+        events = []
+        while self.events.poll():
+            events.append(self.events.recv())
+        return events
+
+    def set_caption(self, title):
+        """ Sets the title of the renderer's window """
+        self.captions.send(title)
+
+    def close(self):
+        # SDL turns SIGTERM into a QUIT event, so ask the renderer to stop
+        self.stopped.set()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.video_ram.release()
+        self.dirty.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+def render(name, idle, pending, stopped, events, captions):
+    """ Entry point of the render process """
+    parent = multiprocessing.parent_process()
+    shm = shared_memory.SharedMemory(name=name)
+    shared_video_ram = np.ndarray((SCREEN_WIDTH, 32), dtype=np.uint8, buffer=shm.buf)
+    shared_dirty = np.ndarray(SCREEN_WIDTH, dtype=np.uint8, buffer=shm.buf, offset=VIDEO_RAM_SIZE)
+    video_ram = np.zeros((SCREEN_WIDTH, 32), dtype=np.uint8)
+    dirty = bytearray(b'\x01' * SCREEN_WIDTH)
+
+    pygame.display.init()
+    screen = Screen()
+    idle.set()
+
+    while not stopped.is_set() and parent.is_alive():
+        for event in pygame.event.get():
+            if event.type in (pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP):
+                events.send((event.type, getattr(event, 'key', None)))
+        while captions.poll():
+            pygame.display.set_caption("%s, %.0f us/frame presented" % (captions.recv(), screen.cost()))
+
+        if not pending.wait(0.01):
+            continue
+        pending.clear()
+        # copy the snapshot out so the CPU process can write the next one
+        # while this one is being drawn
+        video_ram[:] = shared_video_ram
+        dirty[:] = shared_dirty.tobytes()
+        idle.set()
+
+        screen.present(video_ram, dirty)
+
+    del shared_video_ram, shared_dirty
+    shm.close()
@@ -0,0 +1,56 @@
+import struct
+
+MAGIC = b'INPT'
+VERSION = 1
+
+HEADER = struct.Struct('<4sH')
+# frame number and the values of the p1 and p2 ports from that frame on
+RECORD = struct.Struct('<IBB')
+
+
+class InputRecorder:
+    """
+    Latches the live input at every frame and logs the controller ports
+    whenever they change
+    """
+
+    def __init__(self, fname, machine):
+        self.machine = machine
+        self.f = open(fname, 'wb')
+        self.f.write(HEADER.pack(MAGIC, VERSION))
+        self.ports = None
+
+    def latch(self, frame):
+        self.machine.bus.latch_input()
+        controller = self.machine.controller
+        ports = (controller.get_p1(), controller.get_p2())
+        if ports != self.ports:
+            self.f.write(RECORD.pack(frame, *ports))
+            self.ports = ports
+
+    def close(self):
+        self.f.close()
+
+
+class InputReplay:
+    """ Sets the controller ports from a log written by InputRecorder """
+
+    def __init__(self, fname, machine):
+        self.machine = machine
+        with open(fname, 'rb') as f:
+            data = f.read()
+        magic, version = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d input log" % (fname, VERSION))
+        self.records = list(RECORD.iter_unpack(data[HEADER.size:]))
+        self.next = 0
+
+    def latch(self, frame):
+        records = self.records
+        while self.next < len(records) and records[self.next][0] <= frame:
+            _, p1, p2 = records[self.next]
+            self.machine.controller.restore(p1, p2)
+            self.next += 1
+
+    def close(self):
+        pass
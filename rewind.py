@@ -0,0 +1,104 @@
+import numpy as np
+import savestate
+
+from collections import deque
+
+
+def delta(data, key):
+    """
+    Encodes the bytes of data that differ from key
+
+    Returns a (starts, ends, values) tuple of the runs of changed bytes and
+    their contents XORed with key
+    """
+    diff = np.bitwise_xor(data, key)
+    changed = np.flatnonzero(diff)
+    if not len(changed):
+        return np.empty(0, np.uint32), np.empty(0, np.uint32), b''
+    breaks = np.flatnonzero(np.diff(changed) != 1)
+    starts = changed[np.concatenate(([0], breaks + 1))].astype(np.uint32)
+    ends = changed[np.concatenate((breaks, [len(changed) - 1]))].astype(np.uint32) + 1
+    return starts, ends, diff[changed].tobytes()
+
+
+def apply(key, starts, ends, values):
+    """ Returns the bytes encoded by delta against key """
+    diff = np.zeros(len(key), np.uint8)
+    # +1 where a run starts and -1 where it ends, the runs never touch
+    bounds = np.zeros(len(key) + 1, np.int8)
+    bounds[starts] = 1
+    bounds[ends] = -1
+    diff[np.cumsum(bounds[:-1]).astype(bool)] = np.frombuffer(values, np.uint8)
+    return np.bitwise_xor(key, diff).tobytes()
+
+
+class Rewind:
+    """
+    Ring buffer of the save states of the last frames
+
+    Every keyframe_interval frames the whole save state is kept, the frames
+    in between only keep the runs of bytes that differ from the previous
+    keyframe. Keyframes are freed with the last frame referring to them.
+    """
+
+    def __init__(self, machine, seconds=60, fps=60, keyframe_interval=60):
+        self.machine = machine
+        self.frames = deque(maxlen=seconds * fps)
+        self.keyframe_interval = keyframe_interval
+        self.buf = bytearray(savestate.size(machine))
+        self.data = np.frombuffer(self.buf, np.uint8)
+        self.key = None
+        self.since_key = keyframe_interval
+        # set to go back a frame at the next apply
+        self.requested = False
+
+    def record(self):
+        """ Saves the current frame """
+        savestate.snapshot(self.machine, self.buf)
+        if self.since_key >= self.keyframe_interval:
+            self.key = np.frombuffer(bytes(self.buf), np.uint8)
+            self.since_key = 0
+            self.frames.append((self.key, None))
+        else:
+            self.frames.append((self.key, delta(self.data, self.key)))
+        self.since_key += 1
+
+    def request(self):
+        """
+        Asks to go back a frame, the machine can't be restored while its
+        scheduler fires the events so it's stopped until apply is called
+        """
+        self.requested = True
+        self.machine.stop()
+
+    def apply(self):
+        """ Goes back a frame if it was requested """
+        if self.requested:
+            self.requested = False
+            self.rewind()
+
+    def rewind(self, frames=1):
+        """
+        Restores the state of an earlier frame, recording resumes from it
+
+        Returns False when there is no earlier frame left
+        """
+        if len(self.frames) < 2:
+            return False
+        for _ in range(min(frames, len(self.frames) - 1)):
+            self.frames.pop()
+        key, runs = self.frames[-1]
+        savestate.restore(self.machine, key if runs is None else apply(key, *runs))
+        # the next frame starts a new keyframe
+        self.since_key = self.keyframe_interval
+        return True
+
+    def size(self):
+        """ Returns the number of bytes held by the buffer """
+        keys = {id(key): key.nbytes for key, _ in self.frames}
+        size = sum(keys.values())
+        for key, runs in self.frames:
+            if runs is not None:
+                starts, ends, values = runs
+                size += starts.nbytes + ends.nbytes + len(values)
+        return size
@@ -0,0 +1,86 @@
+import struct
+
+from memmap import PAGE_CODE
+
+MAGIC = b'8080'
+VERSION = 1
+
+# magic, version, a, f, b, c, d, e, h, l, sp, pc, int_enable, cycles,
+# shift register, shift offset, p1 and p2 ports, pending interrupt (0 for
+# none), cycles of the next half frame and end of frame, frame count and
+# memory size; the memory follows
+HEADER = struct.Struct('<4sH8BHHBQHBBBBQQQI')
+
+
+def size(machine):
+    """ Returns the size of the save states of a machine """
+    return HEADER.size + len(machine.state.memory)
+
+
+def snapshot(machine, buf=None):
+    """
+    Saves the state and the devices of a machine
+
+    Arguments:
+        machine (machine.Machine): machine to save
+        buf (bytearray): buffer of the save state, reused between snapshots
+            when given
+
+    Returns the buffer
+    """
+    state = machine.state
+    interrupts = machine.bus.interrupts
+    if buf is None:
+        buf = bytearray(size(machine))
+    HEADER.pack_into(
+        buf, 0, MAGIC, VERSION,
+        state.a, state.f, state.b, state.c, state.d, state.e, state.h, state.l,
+        state.sp & 0xffff, state.pc, state.int_enable, state.cycles,
+        *machine.shift_register.snapshot(), *machine.controller.snapshot(),
+        interrupts[0] if interrupts else 0,
+        *machine.display.snapshot(), len(state.memory),
+    )
+    memoryview(buf)[HEADER.size:] = state.memory
+    return buf
+
+
+def restore(machine, data):
+    """
+    Restores the state and the devices of a machine from a save state, the
+    memory is copied into the existing one
+
+    Raises ValueError if data isn't a save state of this version or of a
+    memory of the same size
+    """
+    state = machine.state
+    view = memoryview(data)
+    (magic, version, a, f, b, c, d, e, h, l, sp, pc, int_enable, cycles,
+     register, offset, p1, p2, interrupt, half, end, frames, length) = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version %d save state" % VERSION)
+    if length != len(state.memory):
+        raise ValueError("save state of a %d bytes memory" % length)
+
+    memory = view[HEADER.size:HEADER.size + length]
+    # the translated code of the pages that change is dropped
+    for page, flags in enumerate(state.pages):
+        start = page << 8
+        if flags & PAGE_CODE and memory[start:start + 0x100] != state.memory[start:start + 0x100]:
+            for adr in range(start, start + 0x100):
+                if memory[adr] != state.memory[adr]:
+                    state.invalidate(adr)
+    state.memory[:] = memory
+    state.dirty[:] = b'\x01' * len(state.dirty)
+
+    state.a, state.f, state.b, state.c = a, f, b, c
+    state.d, state.e, state.h, state.l = d, e, h, l
+    state.sp, state.pc = sp, pc
+    state.int_enable, state.cycles = int_enable, cycles
+
+    machine.shift_register.restore(register, offset)
+    machine.controller.restore(p1, p2)
+    machine.bus.interrupts.clear()
+    if interrupt:
+        machine.bus.interrupts.append(interrupt)
+    machine.bus.scheduler.clear()
+    machine.display.restore(half, end, frames)
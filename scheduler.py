@@ -0,0 +1,39 @@
+import heapq
+
+
+class Scheduler:
+    """
+    Queue of timed events, keyed by the absolute cycle count at which they
+    have to fire
+    """
+
+    def __init__(self):
+        self._events = []
+        self._count = 0
+
+    def schedule(self, cycle, callback):
+        """
+        Schedules a callback
+
+        Arguments:
+            cycle (int): absolute cycle count at which to fire the event
+            callback (callable): called with the cycle it was scheduled for
+        """
+        # the counter keeps events scheduled for the same cycle in order
+        heapq.heappush(self._events, (cycle, self._count, callback))
+        self._count += 1
+
+    def clear(self):
+        """ Drops every scheduled event """
+        self._events.clear()
+
+    def next_cycle(self):
+        """ Returns the cycle count of the next event """
+        return self._events[0][0] if self._events else float('inf')
+
+    def run(self, cycles):
+        """ Fires every event due at the given cycle count """
+        events = self._events
+        while events and events[0][0] <= cycles:
+            cycle, _, callback = heapq.heappop(events)
+            callback(cycle)
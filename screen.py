@@ -0,0 +1,55 @@
+import time
+import numpy as np
+import pygame
+
+from cpu import PALETTE, SCREEN_WIDTH, SCREEN_HEIGHT, dirty_spans, rasterize
+
+
+class Screen:
+    """
+    Window the video RAM is rasterized straight into
+
+    The pixels are written through a surfarray view of the window surface
+    held for the lifetime of the screen, a 2D view of mapped pixels or a 3D
+    view of the color channels for 24-bit surfaces, so presenting a frame
+    allocates no surface or frame array and copies nothing to the window.
+    The time spent presenting is accumulated until cost is called.
+    """
+
+    def __init__(self):
+        self.surface = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        if self.surface.get_bytesize() == 3:
+            self.pixels = pygame.surfarray.pixels3d(self.surface)
+            self.palette = PALETTE
+        else:
+            self.pixels = pygame.surfarray.pixels2d(self.surface)
+            self.palette = np.array([self.surface.map_rgb(color) for color in PALETTE.tolist()],
+                                    dtype=self.pixels.dtype)
+        self.elapsed = 0.0
+        self.frames = 0
+
+    def present(self, video_ram, dirty):
+        """
+        Rasterizes the rows of video RAM flagged in dirty into the window and
+        updates their columns on screen, the flags are cleared
+
+        Arguments:
+            video_ram (np.ndarray): (224, 32) bytes of video RAM
+            dirty (bytearray): dirty row flags, see cpu.State.dirty
+        """
+        now = time.perf_counter()
+        spans = dirty_spans(dirty)
+        rasterize(video_ram, self.pixels, spans, self.palette)
+        dirty[:] = bytes(SCREEN_WIDTH)
+        if spans:
+            pygame.display.update([pygame.Rect(start, 0, end - start, SCREEN_HEIGHT)
+                                   for start, end in spans])
+        self.elapsed += time.perf_counter() - now
+        self.frames += 1
+
+    def cost(self):
+        """ Returns the mean time of the frames presented since the last call, in microseconds """
+        cost = self.elapsed / self.frames * 1e6 if self.frames else 0.0
+        self.elapsed = 0.0
+        self.frames = 0
+        return cost
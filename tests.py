@@ -1,10 +1,20 @@
 import argparse
+import hashlib
+import random
 import sys
 import cpu
 import disassembler
+import savestate
 
+from machine import Machine
+from translator import Translator
 
-def execute_test(fname, success_check, debug=0):
+# sha1 of the frame rasterized from random video RAM (seeded with 0x2400),
+# as produced by the original pure python rasterizer
+GOLDEN_FRAME = '22bb77ec3f832672cc2f7afd5beb472b2f83fdba'
+
+
+def execute_test(fname, success_check, debug=0, translate=False):
     # copied from https://github.com/begoon/i8080-core/blob/master/i8080_test.c
     success = 0
     # load test program
@@ -17,6 +27,8 @@ def execute_test(fname, success_check, debug=0):
     state.memory[5] = 0xC9
     state.pc = 0x100
     print(" Test suite: %s" % fname)
+    # blocks end at every branch, so the checks below still see pc 0 and 5
+    step = Translator(state).run_block if translate else cpu.emulate
 
     # start testing
     while 1:
@@ -40,7 +52,7 @@ def execute_test(fname, success_check, debug=0):
                 success = 1
             if state.c == 2:
                 print(chr(state.e), end='', flush=True)
-        cpu.emulate(state)
+        step(state)
         if state.pc == 0:
             print("\n Jump to 0000 from %04x" % pc)
             if success_check and not success:
@@ -49,22 +61,95 @@ def execute_test(fname, success_check, debug=0):
             return
 
 
+def execute_raster_test():
+    print(" Test suite: rasterize")
+    state = cpu.State(b'')
+    video_ram = random.Random(0x2400).randbytes(cpu.VIDEO_RAM_SIZE)
+    state.memory[cpu.VIDEO_RAM:cpu.VIDEO_RAM + cpu.VIDEO_RAM_SIZE] = video_ram
+    frame = state.rasterize()
+    if hashlib.sha1(frame.tobytes()).hexdigest() != GOLDEN_FRAME:
+        print(" Frame differs from the golden frame")
+        sys.exit(1)
+    print(" Frame matches the golden frame")
+
+
+def execute_memmap_test(translate=False):
+    print(" Test suite: memory map")
+    rom = bytes([
+        0x3e, 0x3c,        # MVI A,3c
+        0x32, 0x00, 0x01,  # STA 0100, ROM
+        0x32, 0x00, 0x41,  # STA 4100, mirror of 2100
+        0x3a, 0x00, 0x41,  # LDA 4100
+        0x47,              # MOV B,A
+        0x3a, 0x00, 0x21,  # LDA 2100
+        0x4f,              # MOV C,A
+        0x21, 0x20, 0x24,  # LXI H,2420, video RAM row 1
+        0x77,              # MOV M,A
+    ])
+    state = cpu.State(rom, cpu.MEMORY_MAP)
+    state.dirty[:] = bytes(cpu.SCREEN_WIDTH)
+    step = Translator(state).run_block if translate else cpu.emulate
+    while state.pc < len(rom):
+        step(state)
+    if state.memory[0x100] != 0:
+        print(" Write to the ROM at 0100 wasn't dropped")
+        sys.exit(1)
+    if (state.b, state.c, state.memory[0x6100]) != (0x3c, 0x3c, 0x3c):
+        print(" Mirror at 4100 doesn't read back what was written")
+        sys.exit(1)
+    if state.dirty != bytes([0, 1]) + bytes(cpu.SCREEN_WIDTH - 2):
+        print(" Store to 2420 didn't mark video RAM row 1 dirty")
+        sys.exit(1)
+    print(" Memory map drops ROM writes, mirrors RAM and marks dirty rows")
+
+
+def execute_savestate_test(fname, translate=False):
+    print(" Test suite: save state of %s" % fname)
+    with open(fname, 'rb') as f:
+        machine = Machine(bytes(0x100) + f.read(), ())
+    state = machine.state
+    state.memory[5] = 0xC9
+    state.pc = 0x100
+    step = machine.engine.run_block if translate else cpu.emulate
+    for _ in range(1000):
+        step(state)
+    saved = savestate.snapshot(machine)
+
+    def run():
+        for _ in range(1000):
+            step(state)
+        return (state.a, state.f, state.bc, state.de, state.hl, state.sp, state.pc,
+                state.cycles, bytes(state.memory))
+
+    expected = run()
+    savestate.restore(machine, saved)
+    if run() != expected:
+        print(" Execution differs after restoring the save state")
+        sys.exit(1)
+    print(" Execution matches after restoring the save state")
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="Emulate programs for the Intel 8080 processor"
     )
     parser.add_argument('-d', '--debug', action='count', default=0,
                         help="Display debug output, can be specified up to 3 times")
+    parser.add_argument('-t', '--translate', action='store_true', default=False,
+                        help="Execute the test suites through the block translator")
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    execute_test("cpudiag.bin", 0, args.debug)
-    # execute_test("CPUTEST.COM", 0, args.debug)
-    # execute_test("TEST.COM", 0, args.debug)
-    # execute_test("8080PRE.COM", 1, args.debug)
-    # execute_test("8080EX1.COM", 0, args.debug)
+    execute_raster_test()
+    execute_memmap_test(args.translate)
+    execute_savestate_test("CPUTEST.COM", args.translate)
+    execute_test("cpudiag.bin", 0, args.debug, args.translate)
+    # execute_test("CPUTEST.COM", 0, args.debug, args.translate)
+    # execute_test("TEST.COM", 0, args.debug, args.translate)
+    # execute_test("8080PRE.COM", 1, args.debug, args.translate)
+    # execute_test("8080EX1.COM", 0, args.debug, args.translate)
     sys.exit(0)
 
 
@@ -0,0 +1,278 @@
+import inspect
+import re
+
+import cpu
+
+from disassembler import OPCODES
+from memmap import PAGE_CODE, PAGE_MIRROR
+
+# Longest run of instructions translated into a single block
+MAX_BLOCK = 64
+
+# register attributes of the state and the locals they live in inside a block
+REGISTERS = {
+    'a': 'A', 'f': 'F', 'b': 'B', 'c': 'C', 'd': 'D', 'e': 'E', 'h': 'H', 'l': 'L', 'sp': 'SP',
+}
+ATTRIBUTES = {local: attr for attr, local in REGISTERS.items()}
+
+# I/O instructions end a block even though they don't branch, except the
+# ones fused with the shift register
+IO = (0xd3, 0xdb)
+# EI ends a block too, so that an interrupt waiting for it is taken right
+# after it, see machine.Machine.run
+EI = 0xfb
+# JMP and the conditional jumps
+JUMPS = (0xc3, 0xc2, 0xca, 0xd2, 0xda, 0xe2, 0xea, 0xf2, 0xfa)
+
+STATE_REGISTER = re.compile(r'\bstate\.(%s)\b' % '|'.join(REGISTERS))
+LOCAL_REGISTER = re.compile(r'\b(%s)\b' % '|'.join(REGISTERS.values()))
+ASSIGNMENT = re.compile(r'\s*([\w, ]+?)\s*[-+&|^]?=(?!=)')
+PC_STEP = re.compile(r'    state\.pc \+= \d+$')
+CYCLES_STEP = re.compile(r'    state\.cycles \+= (\d+)$')
+# stores to pages of code go through State.write
+STORE = re.compile(r'(\s*)state\.write\((\w+), ')
+
+
+def handler_body(handler):
+    """ Returns the source lines of an opcode handler, minus its signature """
+    lines = inspect.getsource(handler).splitlines()
+    while not lines[0].startswith('def '):
+        lines.pop(0)
+    return [line for line in lines[1:] if line.strip() and not line.strip().startswith('#')]
+
+
+BODIES = [handler_body(handler) for handler in cpu.DISPATCH]
+FUSED_BODIES = {key: handler_body(handler) for key, handler in cpu.FUSED.items()}
+
+
+def decode(opcode, arg1, arg2, fused=()):
+    """
+    Rewrites the handler of an instruction so it can be inlined in a block,
+    the operands become constants and the registers locals. The (opcode,
+    port) keys in fused take the handlers of cpu.FUSED instead.
+
+    Returns a (lines, cycles, branch) tuple, where cycles are the ones the
+    straight-line instruction takes, or None for the instructions left to
+    the interpreter. Instructions that branch keep their own pc and cycle
+    updates and must end the block.
+    """
+    lines = []
+    cycles = 0
+    key = (opcode, arg1)
+    if key in fused:
+        body = FUSED_BODIES[key]
+    else:
+        body = BODIES[opcode]
+    for line in body:
+        line = re.sub(r'\barg1\b', str(arg1), line)
+        line = re.sub(r'\barg2\b', str(arg2), line)
+        line = STATE_REGISTER.sub(lambda m: REGISTERS[m.group(1)], line)
+        for attr in ('memory', 'dirty', 'pages'):
+            line = line.replace('state.' + attr, attr)
+        lines.append(line)
+
+    if (opcode in IO and key not in fused) or opcode == EI or any('state.pc =' in line for line in lines):
+        lines = [line.replace('state.pc', 'PC').replace('state.cycles', 'CYCLES') for line in lines]
+        return lines, 0, True
+
+    straight = []
+    for line in lines:
+        match = CYCLES_STEP.match(line)
+        if match:
+            cycles += int(match.group(1))
+        elif not PC_STEP.match(line):
+            straight.append(line)
+    if any('state.pc' in line or 'state.cycles' in line for line in straight):
+        # HLT and the unimplemented opcode
+        return None
+    return straight, cycles, False
+
+
+def block_source(start, end, body, cycles, loop):
+    """
+    Generates the source of a block function
+
+    Arguments:
+        start (int): address of the first instruction
+        end (int): address following the last byte of the block
+        body (list): (address, size, lines, cycles, branch) of its instructions
+        cycles (int): cycles taken by the straight-line instructions
+        loop (bool): whether the block ends jumping back to its start, the
+            function then keeps looping until the cycle count reaches until
+    """
+    used = set()
+    written = set()
+    for _, _, lines, _, _ in body:
+        for line in lines:
+            used.update(LOCAL_REGISTER.findall(line))
+            match = ASSIGNMENT.match(line)
+            if match:
+                written.update(name.strip() for name in match.group(1).split(','))
+    used = sorted(used)
+    writeback = ['state.%s = %s' % (ATTRIBUTES[local], local)
+                 for local in used if local in written]
+
+    indent = '        ' if loop else '    '
+    code = []
+    elapsed = 0
+    for adr, size, lines, instruction_cycles, branch in body:
+        code.append('    # %04x' % adr)
+        if branch:
+            code.append('    PC = %d' % adr)
+        stores = False
+        for line in lines:
+            code.append(line)
+            match = STORE.match(line)
+            if match and not branch:
+                # a write to the block itself ends it after this instruction
+                spaces, target = match.groups()
+                code.append('%sif %d <= %s < %d:' % (spaces, start, target, end))
+                code.append('%s    stale = 1' % spaces)
+                stores = True
+        elapsed += instruction_cycles
+        if stores:
+            code.append('    if stale:')
+            code += ['        ' + line for line in writeback]
+            code.append('        state.pc = %d' % (adr + size))
+            code.append('        state.cycles = CYCLES + %d' % elapsed)
+            code.append('        return')
+
+    header = ['def block(state, until):', '    memory = state.memory', '    dirty = state.dirty',
+              '    pages = state.pages']
+    header += ['    %s = state.%s' % (local, ATTRIBUTES[local]) for local in used]
+    header.append('    CYCLES = state.cycles')
+    if any('stale = 1' in line for line in code):
+        header.append('    stale = 0')
+    if loop:
+        header.append('    while 1:')
+        code = [indent + line[4:] if line.startswith('    ') else line for line in code]
+        code.append('        CYCLES += %d' % cycles)
+        code.append('        if PC != %d or CYCLES >= until:' % start)
+        code.append('            break')
+        cycles = 0
+    code += ['    ' + line for line in writeback]
+    code.append('    state.pc = %s' % ('PC' if body[-1][4] else end))
+    code.append('    state.cycles = CYCLES + %d' % cycles)
+    return '\n'.join(header + code) + '\n'
+
+
+def interpret(state, until):
+    """ Executes an instruction the translator left to the interpreter """
+    cpu.emulate(state)
+
+
+class Translator:
+    """
+    Translates straight-line runs of 8080 code into python functions
+
+    A block runs from its entry point up to the first branch, I/O
+    instruction or EI. The handlers of its instructions are inlined with the
+    operands replaced by constants and the registers held in locals, and the
+    pc and cycle updates of the straight-line part are folded into a single
+    one at the end of the block. Blocks are compiled once and cached by entry
+    point, instructions that can't be translated are left to the interpreter.
+
+    The ports of a shift register fused with the state (see cpu.State.fuse)
+    don't count as I/O, their OUT and IN are inlined like any other
+    instruction.
+
+    The pages holding translated code are flagged with PAGE_CODE in the page
+    table of the state, the stores to them drop the blocks translated from
+    the written byte so that programs running from RAM or patching themselves
+    stay correct. A translator is bound to the state it's created for, its
+    methods take it anyway so that it can be the engine of a machine.Machine
+    like cpu.Interpreter.
+    """
+
+    def __init__(self, state):
+        self.memory = state.memory
+        self.flags = state.pages
+        state.invalidate = self.invalidate
+        self.fused = cpu.FUSED if state.shifter is not None else ()
+        # entry point -> function, entry point -> end of the block
+        self.blocks = {}
+        self.ends = {}
+        # page -> entry points of the blocks overlapping it
+        self.pages = {}
+
+    def run(self, state, until):
+        """
+        Executes blocks until the cycle count reaches until, the last block
+        may overshoot it
+        """
+        blocks = self.blocks
+        while state.cycles < until:
+            pc = state.pc
+            block = blocks.get(pc)
+            if block is None:
+                block = self.translate(pc)
+            block(state, until)
+
+    def step(self, state):
+        """ Executes the instruction at the current pc """
+        cpu.emulate(state)
+
+    def interrupt(self, state, opcode):
+        cpu.emulate(state, 0, opcode)
+
+    def run_block(self, state):
+        """ Executes the block at the current pc, blocks that loop run once """
+        pc = state.pc
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.translate(pc)
+        block(state, 0)
+
+    def invalidate(self, adr):
+        """ Drops the blocks translated from the byte at adr """
+        # pushes with SP at 0000 wrap to the end of the memory
+        adr %= len(self.memory)
+        ends = self.ends
+        for start in [start for start in self.pages.get(adr >> 8, ()) if start <= adr < ends[start]]:
+            del self.blocks[start]
+            end = ends.pop(start)
+            for page in range(start >> 8, ((end - 1) >> 8) + 1):
+                entries = self.pages[page]
+                entries.discard(start)
+                if not entries:
+                    self.flags[page] &= ~PAGE_CODE
+
+    def translate(self, start):
+        """ Translates and caches the block starting at start, returns its function """
+        memory = self.memory
+        body = []
+        pc = start
+        cycles = 0
+        # the bytes of a mirror change without being written, its code is
+        # left to the interpreter
+        while (len(body) < MAX_BLOCK and pc + 2 < len(memory)
+               and not self.flags[(pc + 2) >> 8] & PAGE_MIRROR):
+            opcode = memory[pc]
+            instruction = decode(opcode, memory[pc + 1], memory[pc + 2], self.fused)
+            if instruction is None:
+                break
+            lines, instruction_cycles, branch = instruction
+            size = OPCODES[opcode][1]
+            body.append((pc, size, lines, instruction_cycles, branch))
+            pc += size
+            cycles += instruction_cycles
+            if branch:
+                break
+
+        if not body:
+            # left to the interpreter, no code to watch
+            self.blocks[start] = interpret
+            self.ends[start] = start
+            return interpret
+
+        # jumps back to the start of the block, e.g. delay loops
+        loop = opcode in JUMPS and (memory[pc - 1] << 8 | memory[pc - 2]) == start
+        source = block_source(start, pc, body, cycles, loop)
+        namespace = {}
+        exec(compile(source, '<block %04x>' % start, 'exec'), vars(cpu), namespace)
+        block = self.blocks[start] = namespace['block']
+        self.ends[start] = pc
+        for page in range(start >> 8, ((pc - 1) >> 8) + 1):
+            self.pages.setdefault(page, set()).add(start)
+            self.flags[page] |= PAGE_CODE
+        return block